@@ -1,16 +1,25 @@
+import json
+import os
 import sys
+from collections import OrderedDict
+
+import numpy as np
 
 from abrox.core.abc_summary import ABCSummary
 from abrox.core.abc_utils import read_external, pickle_results
-from abrox.core.abc_config_check import ConfigTester
+from abrox.core.abc_config_check import ConfigTester, ConfigurationError
 from abrox.core.abc_initializer import ABCInitializer
 from abrox.core.abc_rejection import ABCRejection
-from abrox.core.abc_crossval import ABCCv
-from abrox.core.abc_mcmc_plot import Plotter
 from abrox.core.abc_preprocess import ABCPreProcessor
-from abrox.core.abc_report import ABCReporter
-from abrox.core.abc_mcmc import MCMC
-from abrox.core.abc_random_forest import ABCRandomForest
+from abrox.core.abc_cache import ABCRefTableCache
+from abrox.core.abc_reference_table import RefTable
+from abrox.core.abc_parallel import createPool
+
+# The algorithm, reporting and plotting modules pull in pandas, scipy,
+# sklearn and matplotlib, so they are imported on first use only
+
+# The file recording the growth applied to a stored table
+GROWTH = 'growth.json'
 
 
 class Abc:
@@ -52,38 +61,48 @@ class Abc:
         settings = initializer.extractAndGetSettings()
 
         # Create a wrapper over the user-defined summary function
-        # and obtain the summary statistics of the observed data
-        summarizer = ABCSummary(self.config['summary'])
+        # (and its optional vectorized counterpart) and obtain
+        # the summary statistics of the observed data
+        summarizer = ABCSummary(self.config['summary'], self.config.get('summary_batch'))
         sumStatObsData = summarizer.summarize(obsData)
 
         # Create an instance of the abc preprocessor, responsible for
-        # generating an ABC reference table (a pandas DataFrame)
-        # which contains four columns containing the following information:
-        # Column 0: idx  - (the model index)
-        # Column 1: param - a list of sampled parameters
-        # Column 2: sumstat - a list of the summary statistics
-        # Column 3: distance - the value obtained by evaluating the distance func
-        pp = ABCPreProcessor(modelList, summarizer, sumStatObsData)
+        # generating an ABC reference table (a columnar RefTable)
+        # which contains four numpy arrays containing the following information:
+        # idx  - the model index, shape (n,)
+        # param - the sampled parameters, shape (n, #parameters)
+        # rawsumstat - the unscaled summary statistics, shape (n, #summary statistics)
+        # sumstat - the scaled summary statistics, shape (n, #summary statistics)
+        # distance - the value obtained by evaluating the distance func, shape (n,)
+        # A forest saved next to a stored table predicts new data without the table
+        output = self._predictSaved(settings, modelNames, sumStatObsData)
+        if output is not None:
+            pickle_results(output, settings['outputdir'])
+            return output
 
-        # TODO -> parallel and jobs must also be specified in settings!
-        if settings['extref']:
-            refTable = read_external(settings['extref'])
-        else:
-            refTable = pp.preprocess(settings['nsim'], parallel=True, jobs=4)
+        pp = ABCPreProcessor(modelList, summarizer, sumStatObsData)
+        refTable = self._buildRefTable(pp, settings, sumStatObsData)
 
         # Create a rejecter instance, responsible for filtering
         # the reference table according to the specified number 'keep'
-        # of rows to retain (retains those with smallest distance)
+        # of rows to retain (retains those with smallest distance),
+        # or to all rows within a fixed 'threshold', if specified
         # only use for rejection and MCMC
 
         # According to the specified algorithm, run the abc
         if settings['alg'] == "rejection":
-            subset, threshold = ABCRejection(refTable, settings['specs']['keep']).reject()
+            from abrox.core.abc_crossval import ABCCv
+            from abrox.core.abc_report import ABCReporter
+
+            subset, threshold = ABCRejection(refTable, settings['specs']['keep'],
+                                             settings['specs'].get('threshold')).reject()
             if settings['specs']['cv'] is not None:
                 crossval = ABCCv(refTable, settings['specs']['keep'],
                                            settings['obj'],
                                            settings['specs']['cv'],
-                                           modelNames)
+                                           modelNames, settings['store'],
+                                           settings['backend'], settings['jobs'],
+                                           settings['seed'])
                 output = crossval.report(settings['outputdir'])
             else:
                 reporter = ABCReporter(subset, modelNames,
@@ -93,15 +112,199 @@ class Abc:
                 output = reporter.report()
 
         elif settings['alg'] == "mcmc":
-            subset, threshold = ABCRejection(refTable, settings['specs']['keep']).reject()
+            from abrox.core.abc_mcmc import MCMC
+            from abrox.core.abc_mcmc_plot import Plotter
+
+            subset, threshold = ABCRejection(refTable, settings['specs']['keep'],
+                                             settings['specs'].get('threshold')).reject()
             mcmc = MCMC(pp, subset, threshold, settings)
             samples, output, accepted = mcmc.run()
             plotter = Plotter(samples, settings['pnames'])
             plotter.plot()
 
+        elif settings['obj'] == "inference":
+            from abrox.core.abc_random_forest import ABCRandomForestRegressor
+
+            rf = ABCRandomForestRegressor(refTable, pp, settings)
+            output = rf.run()
+
         else:
-            rf = ABCRandomForest(refTable, pp, settings, modelNames)
+            from abrox.core.abc_random_forest import ABCRandomForest
+
+            # The fitted forest is kept next to a stored table for later runs
+            directory = settings['store']
+            if settings['extref'] and os.path.isdir(settings['extref']):
+                directory = settings['extref']
+            rf = ABCRandomForest(refTable, pp, settings, modelNames, directory)
             output = rf.run()
 
         pickle_results(output, settings['outputdir'])
         return output
+
+    def runBatch(self, datasets):
+        """
+        Run a rejection analysis for several observed datasets over a single
+        reference table. The table is built (or loaded) once, the closest rows
+        of all datasets are found by a nearest-neighbour index (persisted in
+        the store), or by one blocked pass over the table for a fixed threshold,
+        and the datasets are then reported in parallel.
+        :param datasets: a directory containing the datafiles or a list of paths
+        :return: an OrderedDict mapping dataset names to their output. The results
+        of each dataset are written to a sub-directory of the output directory.
+        """
+
+        initializer = ABCInitializer(self.config)
+        modelList, modelNames = initializer.buildAndGetModels()
+        settings = initializer.extractAndGetSettings()
+
+        if settings['alg'] != "rejection" or settings['specs']['cv'] is not None \
+                or settings['specs'].get('pilot'):
+            raise ConfigurationError('Batch inference supports the rejection algorithm '
+                                     'without cross-validation and streaming only.')
+
+        # Import all datasets and summarize them into one matrix
+        obsData = initializer.getObsDataSets(datasets)
+        summarizer = ABCSummary(self.config['summary'], self.config.get('summary_batch'))
+        sumStatObsData = np.array([summarizer.summarize(data) for data in obsData.values()])
+
+        # The table is scored against the first dataset while it is built
+        pp = ABCPreProcessor(modelList, summarizer, sumStatObsData[0])
+        refTable = self._buildRefTable(pp, settings, sumStatObsData[0])
+
+        threshold = settings['specs'].get('threshold')
+        if threshold is None:
+            from abrox.core.abc_index import ABCIndex
+
+            # The keep nearest rows of each dataset
+            index = ABCIndex.forTable(refTable, settings['store'])
+            distances, rows = index.query(sumStatObsData / refTable.mad, settings['specs']['keep'])
+            accepted = list(zip(rows, distances))
+        else:
+            # All rows within the threshold of each dataset
+            distances = pp.distanceMatrix(sumStatObsData, directory=settings['store'])
+            accepted = [(np.flatnonzero(distance <= threshold), distance) for distance in distances]
+            accepted = [(rows, distance[rows]) for rows, distance in accepted]
+
+        # Threads share the table, processes would have to copy it for every dataset
+        backend = 'serial' if settings['backend'] == 'serial' else 'threads'
+        tasks = [(refTable, rows, distance, modelNames, settings,
+                  os.path.join(settings['outputdir'], name))
+                 for (rows, distance), name in zip(accepted, obsData)]
+        with createPool(backend, settings['jobs']) as pool:
+            outputs = pool.starmap(_rejectAndReport, tasks)
+
+        return OrderedDict(zip(obsData, outputs))
+
+    def _predictSaved(self, settings, modelNames, sumStatObsData):
+        """
+        Predict the model probabilities with the random forest saved next to
+        the stored table given as extref, if it was fitted with the same specs.
+        :return: the model probabilities, or None if there is no such forest
+        """
+
+        if settings['alg'] != "randomforest" or settings['obj'] != "comparison" or \
+                not settings['extref'] or not os.path.isdir(settings['extref']) or settings['grow']:
+            return None
+
+        from abrox.core.abc_random_forest import ABCRandomForest
+
+        rf = ABCRandomForest(None, None, settings, modelNames, settings['extref'])
+        if not rf.hasSaved():
+            return None
+        return ABCRandomForest.predictSaved(settings['extref'], sumStatObsData)
+
+    def _buildRefTable(self, pp, settings, sumStatObsData):
+        """
+        Import, load, or generate the reference table according to the settings.
+        :param pp: the abc preprocessor
+        :param settings: the settings extracted by the initializer
+        :param sumStatObsData: the summary statistics of the observed data
+        :return: the reference table
+        """
+
+        if settings['extref'] and os.path.isdir(settings['extref']) and settings['grow']:
+            # Append simulations to a stored table in place, its MAD and
+            # distances are re-derived from the unscaled summary statistics.
+            # The growth is recorded in the store, so that running the same
+            # settings again does not grow the grown table once more
+            refTable = RefTable.load(settings['extref'], mmap='r')
+            growth = {'grow': settings['grow'], 'seed': settings['seed']}
+            if _loadGrowth(settings['extref']) != dict(growth, digest=refTable.digest()):
+                refTable = pp.grow(refTable, settings['grow'], settings['backend'], settings['jobs'],
+                                   settings['chunksize'], settings['extref'], settings['seed'])
+                _saveGrowth(settings['extref'], dict(growth, digest=refTable.digest()))
+                return refTable
+
+        if settings['extref'] and os.path.isdir(settings['extref']):
+            # A table stored by an earlier run (see 'store') keeps its summary
+            # statistics and MAD, so only the distances to the new data are computed.
+            # Copy-on-write keeps the stored distances of the earlier run intact.
+            return pp.rescore(RefTable.load(settings['extref'], mmap='c'), sumStatObsData)
+
+        if settings['extref']:
+            return read_external(settings['extref'])
+
+        # Streaming rejection only ever holds the rows closest to the observed data
+        if settings['alg'] == "rejection" and settings['specs'].get('pilot'):
+            return pp.preprocessStreaming(settings['nsim'], settings['specs']['keep'],
+                                          settings['specs']['pilot'], settings['backend'],
+                                          settings['jobs'], settings['chunksize'],
+                                          settings['seed'])
+
+        # Finished chunks are checkpointed into the output directory
+        checkpoint = settings['outputdir'] + '/checkpoint' if settings['checkpoint'] else None
+
+        # Identical tables of earlier runs are reused from the cache
+        cache = None
+        if settings['cache']:
+            cache = ABCRefTableCache(settings['cachedir'] or settings['outputdir'] + '/reftable_cache',
+                                     settings['cachesize'])
+
+        return pp.preprocess(settings['nsim'], settings['backend'],
+                             settings['jobs'], settings['chunksize'],
+                             settings['store'], settings['seed'],
+                             checkpoint, settings['resume'], cache,
+                             settings['grow'])
+
+
+def _loadGrowth(directory):
+    """Returns the growth last applied to the table stored in directory, or None."""
+
+    path = os.path.join(directory, GROWTH)
+    if not os.path.isfile(path):
+        return None
+    with open(path) as infile:
+        return json.load(infile)
+
+
+def _saveGrowth(directory, growth):
+    """Record the growth applied to the table stored in directory."""
+
+    with open(os.path.join(directory, GROWTH), 'w') as outfile:
+        json.dump(growth, outfile)
+
+
+def _rejectAndReport(refTable, rows, distance, modelNames, settings, outputdir):
+    """
+    Extract and report the accepted rows of a single dataset of a batch.
+    :param refTable: the shared reference table
+    :param rows: the indices of the accepted rows
+    :param distance: the distances of the dataset to the accepted rows
+    :param modelNames: the names of the models
+    :param settings: the settings extracted by the initializer
+    :param outputdir: the directory the results of the dataset are written to
+    :return: the output of the reporter
+    """
+
+    from abrox.core.abc_report import ABCReporter
+
+    # Keep the table order, with the distances of this dataset
+    order = np.argsort(rows)
+    subset = refTable.subset(rows[order])
+    subset.fillColumn(distance[order], 'distance')
+
+    os.makedirs(outputdir, exist_ok=True)
+    reporter = ABCReporter(subset, modelNames, settings['pnames'], settings['obj'], outputdir)
+    output = reporter.report()
+    pickle_results(output, outputdir)
+    return output
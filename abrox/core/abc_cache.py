@@ -0,0 +1,94 @@
+import os
+import shutil
+
+from abrox.core.abc_reference_table import RefTable
+from abrox.core.abc_utils import fingerprint
+
+
+class ABCRefTableCache:
+    """
+    A content-addressed cache of unscaled reference tables. A table is stored
+    under a key hashed from everything that determines its content (models,
+    priors, simulate and summary code, number of simulations and seed), so
+    that e.g. switching the algorithm reuses the table instead of simulating
+    it again. If maxSize is given, the least recently used tables are evicted
+    until the cache fits into maxSize megabytes.
+    """
+
+    def __init__(self, directory, maxSize=None):
+        self.directory = directory
+        self.maxSize = maxSize
+
+    def key(self, models, summarizer, simulations, seed):
+        """
+        Compute the cache key of a reference table.
+        :param models: the list of ABCModel instances
+        :param summarizer: the ABCSummary instance
+        :param simulations: number of simulations per model
+        :param seed: the base seed (None if not specified)
+        :return: the key as a hex string
+        """
+
+        return fingerprint([model.spec() for model in models],
+                           summarizer.spec(), simulations, seed)
+
+    def growKey(self, key, simulations):
+        """
+        Compute the cache key of a table grown by a number of simulations.
+        :param key: the key of the table before growing
+        :param simulations: number of appended simulations per model
+        :return: the key as a hex string
+        """
+
+        return fingerprint(key, 'grow', simulations)
+
+    def lookup(self, key):
+        """
+        Returns the cached table or None. The columns are memory-mapped
+        copy-on-write, so scaling the table in place never alters the cache.
+        """
+
+        path = self._path(key)
+        if not os.path.isfile(os.path.join(path, 'complete')):
+            return None
+
+        # Mark as recently used
+        os.utime(path)
+        return RefTable.load(path, mmap='c')
+
+    def store(self, key, refTable):
+        """Store an unscaled reference table and evict old tables if necessary."""
+
+        path = self._path(key)
+        refTable.save(path, RefTable.RAW)
+
+        # Only tables with a marker count as cached, so that an interrupted
+        # save is never mistaken for a complete table
+        open(os.path.join(path, 'complete'), 'w').close()
+        self._evict(keep=path)
+
+    def _evict(self, keep):
+        """Remove least recently used tables until the cache fits into maxSize."""
+
+        if self.maxSize is None:
+            return
+
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.isdir(path):
+                size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                entries.append((os.path.getmtime(path), size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.maxSize * 1024**2:
+                break
+            if path != keep:
+                shutil.rmtree(path)
+                total -= size
+
+    def _path(self, key):
+        """Returns the directory of a cached table."""
+
+        return os.path.join(self.directory, key)
@@ -0,0 +1,86 @@
+import json
+import os
+import shutil
+import numpy as np
+
+
+class ABCCheckpoint:
+    """
+    Stores the finished chunks of a reference table generation in a
+    directory, so that an interrupted run can be resumed and only the
+    remaining chunks need to be simulated. Each chunk is saved as
+    a single .npz file named after its row offset in the table.
+    """
+
+    META = 'checkpoint.json'
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def prepare(self, simulations, nModels, seed, chunksize, resume):
+        """
+        Start a new checkpoint or validate an existing one for resuming.
+        :param simulations: number of simulations per model
+        :param nModels: number of models
+        :param seed: the base seed of the chunk seeds (None if not specified)
+        :param chunksize: the number of simulations per chunk
+        :param resume: if True, keep the chunks of a compatible previous run
+        :return: the base seed and the chunk size to use (those of the
+        previous run when resuming, so that the chunk layout matches)
+        """
+
+        metaFile = os.path.join(self.directory, ABCCheckpoint.META)
+
+        if resume and os.path.isfile(metaFile):
+            with open(metaFile) as infile:
+                meta = json.load(infile)
+            if meta['simulations'] != simulations or meta['models'] != nModels or \
+                    (seed is not None and meta['seed'] != seed):
+                raise ValueError('The checkpoint in {} belongs to a different run and '
+                                 'cannot be resumed.'.format(self.directory))
+            return meta['seed'], meta['chunksize']
+
+        # Start from scratch
+        self.clear()
+        os.makedirs(self.directory)
+        if seed is None:
+            seed = int(np.random.randint(2**31))
+        meta = {'simulations': simulations, 'models': nModels,
+                'seed': seed, 'chunksize': chunksize}
+        with open(metaFile, 'w') as outfile:
+            json.dump(meta, outfile)
+        return seed, chunksize
+
+    def finishedOffsets(self):
+        """Returns the row offsets of all chunks saved so far."""
+
+        return {int(name[6:-4]) for name in os.listdir(self.directory)
+                if name.startswith('chunk_') and name.endswith('.npz')}
+
+    def save(self, offset, modelindex, params, sumstats):
+        """
+        Save a finished chunk. The file is written under a temporary
+        name first, so that a killed run never leaves a truncated chunk.
+        """
+
+        path = self._chunkFile(offset)
+        with open(path + '.tmp', 'wb') as outfile:
+            np.savez(outfile, modelindex=modelindex, params=params, sumstats=sumstats)
+        os.replace(path + '.tmp', path)
+
+    def load(self, offset):
+        """Load a saved chunk in the format returned by the workers."""
+
+        with np.load(self._chunkFile(offset)) as chunk:
+            return offset, int(chunk['modelindex']), chunk['params'], chunk['sumstats']
+
+    def clear(self):
+        """Remove the checkpoint directory."""
+
+        if os.path.isdir(self.directory):
+            shutil.rmtree(self.directory)
+
+    def _chunkFile(self, offset):
+        """Returns the path of the file of a chunk."""
+
+        return os.path.join(self.directory, 'chunk_{}.npz'.format(offset))
@@ -1,3 +1,5 @@
+from abrox.core.abc_parallel import BACKENDS
+
 
 class ConfigurationError(Exception):
     pass
@@ -14,7 +16,8 @@ class ConfigTester:
         :return: None
         """
         names = {'data', 'models', 'summary', 'distance', 'settings'}
-        if names != set(self.config.keys()):
+        optional = {'summary_batch'}
+        if not names <= set(self.config.keys()) <= names | optional:
             raise ConfigurationError('The configuration file should contain the following keys: \n' +
                                      ','.join(names))
 
@@ -23,10 +26,13 @@ class ConfigTester:
         Checks if the model key contains the necessary information.
         :return: None
         """
+        names = {'name', 'priors', 'simulate'}
+        optional = {'simulate_batch'}
         for i, modelDict in enumerate(self.config['models']):
-            if set(modelDict.keys()) != {'name', 'priors', 'simulate'}:
+            if not names <= set(modelDict.keys()) <= names | optional:
                 raise ConfigurationError(
-                    "A model needs to be provided with three keys: 'name', 'priors', and 'simulate'")
+                    "A model needs to be provided with three keys: 'name', 'priors', and 'simulate' "
+                    "(and optionally 'simulate_batch')")
 
     def _checkDataSetting(self):
         """
@@ -73,9 +79,77 @@ class ConfigTester:
         if self.config['settings']['objective'] == "comparison" and len(self.config['models']) < 2:
             raise ConfigurationError('Define at least two models for comparison.')
 
+        # check if the random forest error estimate is known
+        method = self.config['settings']['method']
+        if method['algorithm'] == 'randomforest' and method['specs'].get('error', 'oob') not in ('oob', 'cv'):
+            raise ConfigurationError("'error' of the random forest should be 'oob' or 'cv'.")
+
         if self.config['settings']['objective'] == "inference" and len(self.config['models']) > 1:
             raise ConfigurationError('Please define only one model for parameter inference.')
 
+    def _checkReferenceTableSettings(self):
+        """
+        Check if the parallel settings of the reference table are valid.
+        :return: None
+        """
+        reftable = self.config['settings']['reftable']
+        if reftable.get('backend', 'processes') not in BACKENDS:
+            raise ConfigurationError("'backend' should be one of: " + ', '.join(BACKENDS))
+
+        jobs = reftable.get('jobs')
+        if jobs is not None and jobs != -1 and (int(jobs) != jobs or jobs < 1):
+            raise ConfigurationError("'jobs' should be a positive integer, or None or -1 for all cores.")
+
+        chunksize = reftable.get('chunksize')
+        if chunksize is not None and (int(chunksize) != chunksize or chunksize < 1):
+            raise ConfigurationError("'chunksize' should be a positive integer or None.")
+
+        grow = reftable.get('grow', 0)
+        if int(grow) != grow or grow < 0:
+            raise ConfigurationError("'grow' should be a non-negative integer.")
+
+    def _checkStreamingSettings(self):
+        """
+        Check if the pilot run of streaming rejection is valid.
+        :return: None
+        """
+        method = self.config['settings']['method']
+        pilot = method['specs'].get('pilot')
+        if method['algorithm'] != 'rejection' or pilot is None:
+            return
+
+        if int(pilot) != pilot or pilot < 1:
+            raise ConfigurationError("'pilot' should be a positive integer or None.")
+        if method['specs'].get('cv') is not None:
+            raise ConfigurationError('Streaming rejection (pilot) cannot be combined with cross validation.')
+
+    def _checkMCMCSettings(self):
+        """
+        Check if the number of MCMC chains, burn-in, thinning and
+        the target acceptance rate of the adaptive proposal are valid.
+        :return: None
+        """
+        method = self.config['settings']['method']
+        if method['algorithm'] != 'mcmc':
+            return
+
+        chains = method['specs'].get('n_chains', 1)
+        if int(chains) != chains or chains < 1:
+            raise ConfigurationError("'n_chains' should be a positive integer.")
+
+        thin = method['specs']['thin']
+        if int(thin) != thin or thin < 1:
+            raise ConfigurationError("'thin' should be a positive integer.")
+
+        if not 0 <= method['specs']['burn'] < method['specs']['chl']:
+            raise ConfigurationError("'burn' should be non-negative and smaller than 'chl'.")
+
+        adapt = method['specs'].get('adapt')
+        if adapt is not None and not 0 < adapt < 1:
+            raise ConfigurationError("'adapt' should be a target acceptance rate between 0 and 1 or None.")
+        if adapt is not None and method['specs']['burn'] == 0:
+            raise ConfigurationError("The proposal is only adapted during burn-in, 'adapt' requires 'burn' > 0.")
+
     def checkForErrors(self):
         """
         Run all sanity tests on the config file.
@@ -88,3 +162,6 @@ class ConfigTester:
         self._checkDistanceSettings()
         self._checkDirectory()
         self._checkObjective()
+        self._checkReferenceTableSettings()
+        self._checkStreamingSettings()
+        self._checkMCMCSettings()
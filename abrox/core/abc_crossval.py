@@ -1,130 +1,164 @@
+import os
+import tempfile
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib.backends.backend_pdf
 
-from abrox.core.abc_utils import toArray, euclideanDistance
+from abrox.core.abc_index import ABCIndex
+from abrox.core.abc_parallel import createPool, resolveJobs
+from abrox.core.abc_reference_table import RefTable
+
+
+# Per-worker state, filled once by _initWorker when the pool starts
+_workerState = {}
+
+
+def _initWorker(refTable, directory, index, indexDir, indexKey, keep, objective, modelNames):
+    """
+    Store a cross validation instance and the index in the worker. Worker
+    processes get the directory of the table instead of the table and
+    memory-map its columns read-only, so that the table is shared, not copied.
+    They neither get the index, but load the one saved in indexDir under
+    indexKey (the digest of the full table, which a worker cannot compute
+    from the columns it maps).
+    """
+
+    if directory is not None:
+        refTable = RefTable.load(directory, mmap='r')
+    if index is None:
+        index = ABCIndex.load(indexDir, refTable.getColumn('sumstat'), indexKey)
+    _workerState['cv'] = ABCCv(refTable, keep, objective, 0, modelNames)
+    _workerState['index'] = index
+
+
+def _crossValidateBatch(seed, count):
+    """
+    Pick count pseudo-observed rows with a generator of their own and cross validate them.
+    :return: the picked rows and their predictions or estimates
+    """
+
+    cv = _workerState['cv']
+    picks = np.random.RandomState(seed).choice(len(cv.refTable), size=count)
+    return picks, cv.crossValidate(picks, _workerState['index'])
 
 
 class ABCCv:
 
-    def __init__(self, refTable, keep, objective, times, modelNames=None):
+    # Number of pseudo-observed rows per task, fixed so that the
+    # results do not depend on the number of workers
+    BATCHSIZE = 100
+
+    def __init__(self, refTable, keep, objective, times, modelNames=None, indexDir=None,
+                 backend='serial', jobs=None, seed=None):
         self.estimatedParams = None
         self.trueParams = None
         self.refTable = refTable
-        self.sumStatArray = toArray(self.refTable,'sumstat')
-        self.paramArray = toArray(self.refTable,'param')
-        self.indexList = np.arange(len(self.refTable.index))
+        self.sumStatArray = self.refTable.getColumn('sumstat')
+        self.paramArray = self.refTable.getColumn('param')
+        self.modelArray = self.refTable.getColumn('idx')
         self.picks = []
         self.keep = keep
         self.objective = objective
         self.times = times
         self.modelNames = modelNames
+        self.indexDir = indexDir
+        self.backend = backend
+        self.jobs = jobs
+        self.seed = seed
 
-    def _getRandomIndices(self):
+    def _generateBatches(self):
         """
-        Pick a random row index from the reference table and the remaining indices.
-        :return: both the picked index and the remaining indices.
+        Split the pseudo-observed rows into batches, each with a seed derived from the
+        base seed and the batch number, so that a given batch always picks the same rows.
+        :return: a list of (seed, count) tuples
         """
-        picked = np.random.choice(self.indexList)
-
-        self.picks.append(picked)
+        seed = self.seed if self.seed is not None else np.random.randint(2**31)
+        return [(np.random.SeedSequence([seed, start]).generate_state(1)[0],
+                 min(ABCCv.BATCHSIZE, self.times - start))
+                for start in range(0, self.times, ABCCv.BATCHSIZE)]
 
-        notPicked = self.indexList[self.indexList != picked]
-        return picked, notPicked
-
-    def calculateDistance(self, picked, notPicked):
+    def _sharedDirectory(self, tmpDirectory):
         """
-        Compute distances between all simulated summary statistics and
-        the pseudo-observed summary statistic
-        :return: distances (one less then the number of rows of refTable)
+        Returns a directory holding the columns needed by worker processes: the
+        directory of the table if all of them are memory-mapped from the same
+        directory, otherwise tmpDirectory after saving the columns there.
         """
-        distances = euclideanDistance(self.sumStatArray[notPicked], self.sumStatArray[picked])
-        return distances
+        columns = ('idx', 'param', 'sumstat')
+        files = [getattr(self.refTable.getColumn(name), 'filename', None) for name in columns]
+        directories = {os.path.dirname(f) for f in files if f is not None}
+        if None not in files and len(directories) == 1:
+            return directories.pop()
+        self.refTable.save(tmpDirectory, columns)
+        return tmpDirectory
 
-    def deletePickedRow(self,picked):
+    def computeSubsets(self, picks, index):
         """
-        Drop the picked row from the reference table.
-        :param picked: integer representing the row-index.
-        :return: None
+        Find the subsets of all pseudo-observed rows at once:
+            - treat each picked summary statistic as pseudo-observed
+            - find its keep nearest rows via the index, excluding the picked row itself
+        :param picks: the picked row indices.
+        :param index: the nearest-neighbour index of the table.
+        :return: row indices of the subsets, shape (#picks, keep).
         """
-        subTable = self.refTable.drop(self.refTable.index[[picked]], inplace=False)
-        return subTable
+        _, subsets = index.query(self.sumStatArray[picks], self.keep, exclude=picks)
+        return subsets
 
-    def getSubset(self, subTable):
+    def getEstimates(self, subsets):
         """
-        Return tuple with filtered Reference Table only containing
-        rows for which the distance is < threshold and threshold itself.
-        :return: the tuple
+        Compute mean for each parameter in each subset.
+        :param subsets: the row indices of the subsets, shape (#picks, keep).
+        :return: the means (estimates), shape (#picks, #parameters)
         """
-        q = self.keep / len(subTable.index) * 100
-        threshold = np.percentile(subTable['distance'],q=q)
-        subset = subTable[subTable['distance'] < threshold]
-        return subset
+        return np.mean(self.paramArray[subsets], axis=1)
 
-    def getEstimates(self,subset):
+    def getPrediction(self, subsets):
         """
-        Compute mean for each parameter in subset.
-        :param subset: the subset table.
-        :return: the means (estimates)
+        Return a prediction (the most frequent model index) for each subset.
+        :param subsets: the row indices of the subsets, shape (#picks, keep).
+        :return: the predictions, shape (#picks,)
         """
-        paramArray = toArray(subset,'param')
-        return np.mean(paramArray, axis=0)
+        models = self.modelArray[subsets]
+        nModels = len(self.modelNames) if self.modelNames is not None else self.modelArray.max() + 1
+        counts = np.stack([np.sum(models == model, axis=1) for model in range(nModels)], axis=1)
+        return np.argmax(counts, axis=1)
 
-    def getPrediction(self,subset):
+    def crossValidate(self, picks, index):
         """
-        Return a prediction (model index) based on a subset of the reference table.
-        :param subset: the subset of the ref table.
-        :return: a prediction
+        Compute the model predictions (comparison) or the
+        estimated parameters (inference) of the picked rows.
         """
-        _ , counts = np.unique(subset['idx'], return_counts=True)
-        return np.argmax(counts)
+        subsets = self.computeSubsets(picks, index)
 
-    def computeSubset(self):
-        """
-        Run cross validation scheme:
-            - pick a simulated summary statistic from the ref table.
-            - treat it as pseudo-observed
-            - compute the distances between all other and the pseudo-observed one.
-            - compute subset reference table based on distances.
-        :param times: accuracy of cv.
-        :return: subset reference table.
-        """
-
-        picked, notPicked = self._getRandomIndices()
-        distances = self.calculateDistance(picked, notPicked)
-        subTable = self.deletePickedRow(picked)
-        subTable['distance'] = distances
-        filteredSubset = self.getSubset(subTable)
+        if self.objective == "comparison":
+            return self.getPrediction(subsets).astype(np.uint8)[:, np.newaxis]
 
-        return filteredSubset
+        if self.objective == "inference":
+            return self.getEstimates(subsets)
 
     def compute(self):
         """
         Compute the array of estimated parameters if obj is inference.
         Compute the model predictions if obj is comparison.
-        :param times: accuracy of cross validation sheme.
+        The batches of pseudo-observed rows are distributed over the workers.
         """
-        if self.objective == "comparison":
-
-            pred = np.empty(shape=(self.times,1),dtype=np.uint8)
+        jobs = 1 if self.backend == 'serial' else resolveJobs(self.jobs)
 
-            for i in range(self.times):
-                subset = self.computeSubset()
-                pred[i,0] = self.getPrediction(subset)
+        with tempfile.TemporaryDirectory() as tmpDirectory:
+            if self.backend == 'processes':
+                # The index is built (or found) and saved once here, not kept,
+                # so that every worker loads it instead of building its own
+                indexDir = self.indexDir if self.indexDir is not None else tmpDirectory
+                ABCIndex.forTable(self.refTable, indexDir)
+                initargs = (None, self._sharedDirectory(tmpDirectory), None, indexDir, self.refTable.digest())
+            else:
+                initargs = (self.refTable, None, ABCIndex.forTable(self.refTable, self.indexDir), None, None)
+            initargs += (self.keep, self.objective, self.modelNames)
 
-            return pred
+            with createPool(self.backend, jobs, _initWorker, initargs) as pool:
+                results = pool.starmap(_crossValidateBatch, self._generateBatches())
 
-        if self.objective == "inference":
-
-            cols = len(self.refTable.at[0, 'param'])
-            estimatedParams = np.empty(shape=(self.times, cols))
-
-            for i in range(self.times):
-                subset = self.computeSubset()
-                estimatedParams[i, :] = self.getEstimates(subset)
-
-            return estimatedParams
+        # Merge the partial results in batch order
+        self.picks = np.concatenate([picks for picks, _ in results])
+        return np.concatenate([result for _, result in results])
 
     def report(self, outputdir):
         """
@@ -134,11 +168,11 @@ class ABCCv:
 
         if self.objective == "comparison":
             predictions = self.compute()
-            true = toArray(self.refTable, 'idx')[self.picks, :]
-            actual = pd.Series(true[:,0],name="Actual")
+            true = self.modelArray[self.picks]
+            actual = pd.Series(true,name="Actual")
             predicted = pd.Series(predictions[:,0], name="Predicted")
             confusionMatrix = pd.crosstab(actual,predicted)
-            self.saveConfusion(confusionMatrix.as_matrix(),outputdir)
+            self.saveConfusion(confusionMatrix.values,outputdir)
 
             return confusionMatrix
 
@@ -149,7 +183,8 @@ class ABCCv:
             SumSqDiff = np.sum((self.estimatedParams - self.trueParams)**2,axis=0)
             Variance = np.var(self.trueParams,axis=0)
 
-            return np.float(SumSqDiff / Variance)
+            predictionError = SumSqDiff / Variance
+            return float(predictionError[0]) if len(predictionError) == 1 else predictionError
 
     def saveConfusion(self, confusionMatrix, outputdir):
         """
@@ -157,6 +192,9 @@ class ABCCv:
         :param confusionMatrix: confusion matrix as numpy array.
         :return: None
         """
+        import matplotlib.pyplot as plt
+        import matplotlib.backends.backend_pdf
+
         pdf = matplotlib.backends.backend_pdf.PdfPages(outputdir + '/cv_comparison.pdf')
 
         fig = plt.figure()
@@ -186,6 +224,9 @@ class ABCCv:
         Generate multiple plots showing results of cv for parameter inference.
         :return: None
         """
+        import matplotlib.pyplot as plt
+        import matplotlib.backends.backend_pdf
+
         pdf = matplotlib.backends.backend_pdf.PdfPages(outputdir + '/cv_inference.pdf')
         for i,col in enumerate(self.estimatedParams.T):
             plt.scatter(self.estimatedParams[:, i], self.trueParams[:, i], alpha=0.5)
@@ -0,0 +1,146 @@
+import os
+import pickle
+import numpy as np
+from scipy.spatial import cKDTree
+
+from abrox.core.abc_utils import euclideanDistanceMatrix
+
+
+class ABCIndex:
+    """
+    A nearest-neighbour index over the scaled summary statistics of a
+    reference table. For low to moderate dimensions, queries are answered
+    by a KD-tree in sub-linear time. For higher dimensions, where a tree
+    degenerates to a linear scan anyway, the queries are answered by
+    blocked brute force over the table.
+    """
+
+    # Up to this number of summary statistics a KD-tree is used
+    MAXTREEDIM = 16
+
+    # Number of table rows and query points compared at once (brute force)
+    BLOCKSIZE = 100000
+    QUERYBLOCKSIZE = 100
+
+    FILE = 'index.pkl'
+
+    def __init__(self, sumstat, tree=None):
+        self.sumstat = sumstat
+        self.tree = tree
+
+    @classmethod
+    def build(cls, sumstat):
+        """
+        Build the index over the scaled summary statistics.
+        :param sumstat: the scaled summary statistics, shape (n, s)
+        :return: the index
+        """
+
+        if sumstat.shape[1] <= ABCIndex.MAXTREEDIM:
+            return cls(sumstat, cKDTree(sumstat))
+        return cls(sumstat)
+
+    @classmethod
+    def forTable(cls, refTable, directory=None):
+        """
+        Returns the index of a reference table. If a directory is given, an
+        index saved there for the same table is loaded, or the new index is saved.
+        :param refTable: the reference table with scaled summary statistics
+        :param directory: optional directory (e.g. the store of the table)
+        :return: the index
+        """
+
+        sumstat = refTable.getColumn('sumstat')
+        key = refTable.digest()
+        if directory is not None:
+            index = cls.load(directory, sumstat, key)
+            if index is not None:
+                return index
+
+        index = cls.build(sumstat)
+        if directory is not None:
+            index.save(directory, key)
+        return index
+
+    def save(self, directory, key):
+        """Save the index (the tree, if any) together with the key of its table."""
+
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, ABCIndex.FILE), 'wb') as outfile:
+            pickle.dump((key, self.tree), outfile, pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, directory, sumstat, key):
+        """
+        Load a saved index.
+        :return: the index, or None if there is none for the table with key
+        """
+
+        path = os.path.join(directory, ABCIndex.FILE)
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as infile:
+            savedKey, tree = pickle.load(infile)
+        return cls(sumstat, tree) if savedKey == key else None
+
+    def query(self, points, k, exclude=None):
+        """
+        Find the k nearest rows of each query point.
+        :param points: the scaled query summary statistics, shape (m, s)
+        :param k: the number of neighbours
+        :param exclude: optional row index per query point which must not be
+        returned (e.g. the row a pseudo-observed point was taken from)
+        :return: the distances and the row indices, both of shape (m, k)
+        and sorted by distance
+        """
+
+        points = np.atleast_2d(points)
+        k = min(k, len(self.sumstat) - (exclude is not None))
+        if exclude is not None:
+            exclude = np.asarray(exclude)
+        if self.tree is not None:
+            return self._queryTree(points, k, exclude)
+
+        # Limit the size of the distance matrix of each block
+        results = [self._queryBruteForce(points[start:start + ABCIndex.QUERYBLOCKSIZE], k,
+                                         None if exclude is None else
+                                         exclude[start:start + ABCIndex.QUERYBLOCKSIZE])
+                   for start in range(0, len(points), ABCIndex.QUERYBLOCKSIZE)]
+        return np.vstack([r[0] for r in results]), np.vstack([r[1] for r in results])
+
+    def _queryTree(self, points, k, exclude):
+        """Query the KD-tree, asking for one more neighbour to drop the excluded row."""
+
+        extra = 0 if exclude is None else 1
+        distances, rows = self.tree.query(points, k + extra)
+        distances = distances.reshape(len(points), -1)
+        rows = rows.reshape(len(points), -1)
+        if exclude is not None:
+            # Move the excluded rows to the end, keeping the order of the others
+            order = np.argsort(rows == exclude[:, np.newaxis], axis=1, kind='stable')
+            distances = np.take_along_axis(distances, order, axis=1)[:, :k]
+            rows = np.take_along_axis(rows, order, axis=1)[:, :k]
+        return distances, rows
+
+    def _queryBruteForce(self, points, k, exclude):
+        """Scan the table block by block, keeping the k best rows of each query point."""
+
+        bestDistances = np.full((len(points), k), np.inf)
+        bestRows = np.zeros((len(points), k), dtype=np.int64)
+        for start in range(0, len(self.sumstat), ABCIndex.BLOCKSIZE):
+            block = np.asarray(self.sumstat[start:start + ABCIndex.BLOCKSIZE])
+            distances = euclideanDistanceMatrix(points, block)
+            if exclude is not None:
+                inBlock = np.flatnonzero((exclude >= start) & (exclude < start + len(block)))
+                distances[inBlock, exclude[inBlock] - start] = np.inf
+
+            # Merge the block with the best rows found so far
+            distances = np.hstack([bestDistances, distances])
+            rows = np.hstack([bestRows, np.broadcast_to(np.arange(start, start + len(block)),
+                                                        (len(points), len(block)))])
+            selected = np.argpartition(distances, k - 1, axis=1)[:, :k]
+            bestDistances = np.take_along_axis(distances, selected, axis=1)
+            bestRows = np.take_along_axis(rows, selected, axis=1)
+
+        order = np.argsort(bestDistances, axis=1)
+        return np.take_along_axis(bestDistances, order, axis=1), np.take_along_axis(bestRows, order, axis=1)
@@ -1,4 +1,5 @@
-import pandas as pd
+import os
+from collections import OrderedDict
 from itertools import chain
 
 from abrox.core.abc_model import ABCModel
@@ -24,6 +25,26 @@ class ABCInitializer:
                     params = self.config['settings']['test']['fixed']
                     return model.simulate(params)
 
+    def getObsDataSets(self, datasets):
+        """
+        Import several observed datasets for batch inference.
+        :param datasets: a directory (all files in it are imported)
+        or a list of paths of datafiles
+        :return: an OrderedDict mapping dataset names (file names without
+        extension) to the datasets as numpy arrays.
+        """
+
+        if isinstance(datasets, str):
+            directory = datasets
+            datasets = [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+                        if os.path.isfile(os.path.join(directory, name))]
+
+        obsData = OrderedDict()
+        for path in datasets:
+            name = os.path.splitext(os.path.basename(path))[0]
+            obsData[name] = self._loadExternalData(path)
+        return obsData
+
     def buildAndGetModels(self):
         """
         Generate a list of models.
@@ -54,6 +75,17 @@ class ABCInitializer:
                     'nmodels': nModels,
                     'nsim': reftable['simulations'],
                     'extref': reftable['extref'],
+                    'backend': reftable.get('backend', 'processes'),
+                    'jobs': reftable.get('jobs'),
+                    'chunksize': reftable.get('chunksize'),
+                    'store': reftable.get('store'),
+                    'seed': reftable.get('seed'),
+                    'checkpoint': reftable.get('checkpoint', False),
+                    'resume': reftable.get('resume', False),
+                    'cache': reftable.get('cache', False),
+                    'cachedir': reftable.get('cachedir'),
+                    'cachesize': reftable.get('cachesize'),
+                    'grow': reftable.get('grow', 0),
                     'outputdir': outputdir
                     }
 
@@ -72,14 +104,17 @@ class ABCInitializer:
         """
         return self._flattenList([list(d.keys()) for d in self.config['models'][0]['priors']])
 
-    def _loadExternalData(self):
+    def _loadExternalData(self, path=None):
         """
         Import external dataset.
+        :param path: the datafile, defaults to the one specified in the config
         :return: the dataset
         """
 
-        return pd.read_csv(self.config['data']['datafile'], engine='python',
-                            delimiter=self.config['data']['delimiter']).as_matrix()
+        import pandas as pd
+
+        return pd.read_csv(path or self.config['data']['datafile'], engine='python',
+                           delimiter=self.config['data'].get('delimiter')).values
 
 
 
@@ -3,6 +3,11 @@ import pandas as pd
 
 from abrox.core.abc_utils import euclideanDistance
 from abrox.core.abc_wegmann import Wegmann
+from abrox.core.abc_mcmc_diagnostics import rhat, effectiveSampleSize
+from abrox.core.abc_mcmc_store import ABCChainStore
+from abrox.core.abc_mcmc_adaptive import AdaptiveProposal
+from abrox.core.abc_scale import ABCScaler
+from abrox.core.abc_parallel import createPool, resolveJobs
 
 
 class MCMC:
@@ -11,68 +16,250 @@ class MCMC:
     """
     #TODO - give reference to paper
 
+    # Number of steps, for which proposal noise and uniforms are drawn
+    # at once and after which the kept samples are flushed to disk
+    BLOCKSIZE = 10000
+
     def __init__(self, preprocessor, subset, threshold, settings):
 
-        self._pp = preprocessor
-        self._subset = subset
         self._settings = settings
         self._settings['specs']['threshold'] = threshold
-        self._model = self._pp.getFirstModel()
+        self._model = preprocessor.getFirstModel()
         self._priors = self._model.getPriors()
 
+        # The prior of each parameter, in the order of the parameter names
+        self._priorDists = [dist for prior in self._priors for dist in prior.values()]
+        self._nChains = settings['specs'].get('n_chains', 1)
+
+        # Keep only what the chains need (not the reference table),
+        # so that the sampler is cheap to send to worker processes
+        self._summarizer = preprocessor.summarizer
+        self._scaler = preprocessor.scaler
+        self._scaledSumStatObsData = preprocessor.scaledSumStatObsData
+
+        # The kept samples are stored in the output directory while the chains run
+        self._store = ABCChainStore(settings['outputdir'] + '/mcmc')
+
+        # Public attributes, filled by run
+        self.diagnostics = None
+        self.acceptanceRates = None
+        self.skippedSimulations = None
+
+        # A user-defined start is shared by all chains, so that R-hat only
+        # tells whether the chains have mixed, not whether they have converged
+        # from dispersed starts (use the automatic Wegmann starts for that)
         if settings['specs']['proposal'] is None:
-            self._initWegmann()
+            self._initWegmann(subset)
+        else:
+            self._starts = [settings['specs']['start']] * self._nChains
+            if self._nChains > 1:
+                print("Warning: all {} chains start from the same values, "
+                      "R-hat is not reliable.".format(self._nChains))
 
     def run(self):
-        """Runs an ABC-MCMC sampling chain."""
+        """
+        Runs n_chains independent ABC-MCMC sampling chains in parallel and
+        merges their samples. Convergence diagnostics (R-hat and effective
+        sample size per parameter), the acceptance rate and the number of
+        simulations skipped by the prior ratio of each chain are saved to the
+        output directory. If the spec resume is set, chains of an interrupted
+        run continue from their last saved state.
+        :return: the merged samples, their summary and the number of accepted proposals
+        """
+
+        specs = self._settings['specs']
+        resume = specs.get('resume', False)
+
+        # Resumed chains continue with the target they started with, even if
+        # the reference table (hence threshold and MAD) has been simulated anew
+        target = {'threshold': specs['threshold'], 'mad': self._scaler.mad,
+                  'scaledSumStatObsData': self._scaledSumStatObsData}
+        seed, target = self._store.prepare(self._settings.get('seed'), specs['chl'], specs['thin'],
+                                           specs['burn'], self._nChains, resume, target)
+        specs['threshold'] = float(target['threshold'])
+        self._scaler = ABCScaler()
+        self._scaler.mad = target['mad']
+        self._scaledSumStatObsData = target['scaledSumStatObsData']
+
+        # Each chain gets a seed of its own, derived from the base seed
+        seeds = [np.random.SeedSequence([seed, chain]).generate_state(1)[0] for chain in range(self._nChains)]
+
+        # Resumed chains continue with the proposal they started with
+        state = self._store.load(0) if resume else None
+        if state is not None:
+            specs['proposal'] = state['proposal']
+
+        backend = self._settings.get('backend', 'serial') if self._nChains > 1 else 'serial'
+        jobs = 1 if backend == 'serial' else min(resolveJobs(self._settings.get('jobs')), self._nChains)
+        with createPool(backend, jobs) as pool:
+            results = pool.starmap(self._runChain, zip(range(self._nChains), self._starts, seeds,
+                                                        [resume] * self._nChains))
+
+        # The samples are read back from the store
+        chains = np.array([self._store.loadSamples(chain) for chain in range(self._nChains)])
+        accepted = np.array([acc for acc, _ in results])
+        self.skippedSimulations = np.array([skip for _, skip in results])
+        self._diagnose(chains, accepted)
+
+        steps = self._nChains * max(specs['chl'] - 1, 1)
+        print("Simulations skipped by the prior ratio: {} of {} ({:.1%})".format(
+            self.skippedSimulations.sum(), steps, self.skippedSimulations.sum() / steps))
+
+        df = pd.DataFrame(chains.reshape(-1, chains.shape[2]), columns=self._settings['pnames'])
+
+        if specs.get('csv', True):
+            df.assign(chain=np.repeat(np.arange(self._nChains), chains.shape[1])).to_csv(
+                self._settings['outputdir'] + '/posteriorSamples_mcmc.csv')
+
+        return df, df.describe(), int(accepted.sum())
+
+    def _diagnose(self, chains, accepted):
+        """Compute and save the convergence diagnostics, the acceptance rates and skipped simulations."""
+
+        self.acceptanceRates = accepted / max(self._settings['specs']['chl'] - 1, 1)
+        self.diagnostics = pd.DataFrame({'rhat': rhat(chains),
+                                         'ess': np.sum([effectiveSampleSize(chain) for chain in chains], axis=0)},
+                                        index=self._settings['pnames'])
+        self.diagnostics.to_csv(self._settings['outputdir'] + '/mcmc_diagnostics.csv')
+        pd.DataFrame({'acceptance': self.acceptanceRates, 'skipped': self.skippedSimulations}).rename_axis('chain').to_csv(
+            self._settings['outputdir'] + '/mcmc_acceptance.csv')
+
+    def _runChain(self, chain, start, seed, resume):
+        """
+        Runs a single ABC-MCMC sampling chain. Only the draws after burn-in
+        and thinning are kept. They are flushed to the store together with
+        the state of the chain after every block of steps. If adapt is set,
+        a Gaussian proposal is adapted during burn-in (adaptive Metropolis).
+        :param chain: the number of the chain
+        :param start: the starting values
+        :param seed: the seed of the chain
+        :param resume: if True, continue from the saved state of the chain
+        :return: the number of accepted proposals and the number of skipped simulations
+        """
 
         # Extract settings
         chainLength = self._settings['specs']['chl']
         thin = self._settings['specs']['thin']
         burn = self._settings['specs']['burn']
-        start = self._settings['specs']['start']
-        accepted = 0
 
-        # Pre-initialize an array to hold samples
-        samples = np.empty(shape=(chainLength, len(start)))
-        samples[0, :] = start
+        # The draws with index burn, burn + thin, ... (draw 0 is the start) are kept
+        kept = len(range(burn, chainLength, thin))
+        samples = self._store.openSamples(chain, kept, len(start))
+
+        # Proposals are drawn from a generator of the chain, the user
+        # simulate functions draw from the global generator, each with
+        # an independent stream derived from the seed of the chain
+        proposalSeed, simulationSeed = [child.generate_state(1)[0] for child in np.random.SeedSequence(seed).spawn(2)]
+        randomState = np.random.RandomState(proposalSeed)
+        np.random.seed(simulationSeed)
+
+        state = self._store.load(chain) if resume else None
+        if state is None:
+            state = {'step': 0, 'current': np.asarray(start, dtype=np.float64),
+                     'density': self._density(start), 'accepted': 0, 'skipped': 0,
+                     'adaptive': self._initAdaptation()}
+        else:
+            randomState.set_state(state['random'])
+            np.random.set_state(state['global'])
 
-        for i in range(chainLength-1):
-            start, accept = self._metropolis(start)
+        current, density = state['current'], state['density']
+        accepted, skipped = state['accepted'], state['skipped']
+        adaptive = state['adaptive']
+        if state['step'] == 0 and burn == 0:
+            samples[0, :] = current
+
+        for i in range(state['step'], chainLength-1):
+
+            # Save the progress and draw proposal noise and uniforms for a block of steps at once
+            step = i % MCMC.BLOCKSIZE
+            if step == 0:
+                self._saveChain(chain, samples, randomState, step=i, current=current, density=density,
+                                accepted=accepted, skipped=skipped, adaptive=adaptive)
+                count = min(MCMC.BLOCKSIZE, chainLength - 1 - i)
+                if adaptive is None:
+                    noise = self._propose(randomState, count)
+                else:
+                    noise = randomState.standard_normal((count, len(current)))
+                logUniforms = np.log(randomState.uniform(size=count))
+
+            proposed = noise[step] if adaptive is None else adaptive.noise(noise[step])
+            current, density, accept, skip = self._metropolis(current, density, proposed, logUniforms[step])
             accepted += accept
-            if i % thin is 0:
-                samples[i+1, :] = start
+            skipped += skip
+
+            # The proposal is only adapted during burn-in
+            if adaptive is not None and i < burn:
+                adaptive.update(current, accept)
 
-        df = pd.DataFrame(samples[burn:, :], columns=self._settings['pnames'])
+            draw = i + 1
+            if draw >= burn and (draw - burn) % thin == 0:
+                samples[(draw - burn) // thin, :] = current
 
-        df.to_csv(self._settings['outputdir'] + '/posteriorSamples_mcmc.csv')
+        self._saveChain(chain, samples, randomState, step=chainLength - 1, current=current, density=density,
+                        accepted=accepted, skipped=skipped, adaptive=adaptive)
+        return accepted, skipped
 
-        return df, df.describe(), accepted
+    def _saveChain(self, chain, samples, randomState, **state):
+        """Flush the kept samples and save the state of a chain (values, counters and generators)."""
 
-    def _initWegmann(self):
+        state.update({'random': randomState.get_state(), 'global': np.random.get_state(),
+                      'proposal': self._settings['specs']['proposal']})
+        self._store.save(chain, samples, state)
+
+    def _initAdaptation(self):
+        """
+        Returns an adaptive proposal starting from the variances of the proposal
+        distributions, or None if the proposal should not be adapted.
         """
-        Determines starting value of the chain and proposal distribution using
-        the algorithm by Wegmann.
+
+        target = self._settings['specs'].get('adapt')
+        if target is None:
+            return None
+
+        variances = [proposal.var() for proposal in self._settings['specs']['proposal'].values()]
+        return AdaptiveProposal(np.diag(variances), target)
+
+    def _initWegmann(self, subset):
+        """
+        Determines starting values of the chains and proposal distribution
+        using the algorithm by Wegmann. Each chain starts from another
+        randomly picked row of the subset, the rows are picked with a
+        generator seeded from the base seed.
         :return: None
         """
 
-        wegmann = Wegmann(self._subset, self._settings['pnames'])
+        seed = self._settings.get('seed')
+        randomState = np.random.RandomState(None if seed is None else np.random.SeedSequence(seed).generate_state(1)[0])
+
+        wegmann = Wegmann(subset, self._settings['pnames'])
         self._settings['specs']['proposal'] = wegmann.getProposal()
-        self._settings['specs']['start'] = wegmann.getStartingValues()
+        self._starts = list(wegmann.getStartingValuesOfChains(self._nChains, randomState))
+        self._settings['specs']['start'] = self._starts[0]
 
-    def _metropolis(self, old):
-        """Implements a single step of the metropolis algorithm."""
+    def _metropolis(self, old, oldDensity, noise, logUniform):
+        """
+        Implements a single step of the metropolis algorithm with delayed
+        acceptance: the proposal is first tested against the prior ratio,
+        the model is only simulated for proposals, which pass this test.
+        :param old: the current values
+        :param oldDensity: the log-density of the current values
+        :param noise: the proposal noise of this step
+        :param logUniform: the log of the uniform of this step
+        :return: the current values and their log-density, 1 if the proposal
+        was accepted (0 otherwise), and 1 if the simulation was skipped (0 otherwise)
+        """
 
-        new = old + self._propose()
-        accProb = np.min([self._density(new) / self._density(old), 1])
-        u = np.random.uniform()
+        new = old + noise
+        newDensity = self._density(new)
 
-        cnt = 0
-        if self._distance(new) and u < accProb:
-            old = new
-            cnt = 1
+        # Stage one: the prior ratio, no simulation needed
+        if logUniform >= newDensity - oldDensity:
+            return old, oldDensity, 0, 1
 
-        return old, cnt
+        # Stage two: the ABC acceptance (simulation)
+        if self._distance(new):
+            return new, newDensity, 1, 0
+        return old, oldDensity, 0, 0
 
     def _distance(self, param):
         """
@@ -91,11 +278,11 @@ class MCMC:
         except ValueError:
             return False
 
-        sumStat = self._pp.summarizer.summarize(simulation)
-        scaledSumStat = self._pp.scaler.transform(sumStat)
+        sumStat = self._summarizer.summarize(simulation)
+        scaledSumStat = self._scaler.transform(sumStat)
 
         # Decide whether to accept sample or not
-        dist = euclideanDistance(self._pp.scaledSumStatObsData, scaledSumStat, axis=0)
+        dist = euclideanDistance(self._scaledSumStatObsData, scaledSumStat, axis=0)
         accepted = dist < self._settings['specs']['threshold']
         return accepted
 
@@ -107,21 +294,21 @@ class MCMC:
         """
 
         density = 0
-        for prior in self._priors:
-            for i, dist in enumerate(prior.values()):
-                density += dist.logpdf(value[i])
+        for i, dist in enumerate(self._priorDists):
+            density += dist.logpdf(value[i])
         return density
 
-    def _propose(self):
+    def _propose(self, randomState, count):
         """
-        Generate proposed values according to proposal distributions
-        :return: Proposed values
+        Generate the noise of count proposals according to the proposal distributions
+        :param randomState: the generator of the chain
+        :param count: the number of proposals
+        :return: Proposed values, shape (count, #parameters)
         """
 
-        proposedValue = []
-        for paramName, proposal in self._settings['specs']['proposal'].items():
-            proposedValue.append(proposal.rvs())
-        return np.array(proposedValue)
+        proposals = self._settings['specs']['proposal'].values()
+        return np.column_stack([proposal.rvs(size=count, random_state=randomState)
+                                for proposal in proposals])
 
     def _listToDict(self, paramList):
         """
@@ -0,0 +1,83 @@
+import numpy as np
+
+
+class AdaptiveProposal:
+    """
+    Implements a Gaussian random walk proposal, which learns its covariance
+    from the history of the chain (adaptive Metropolis, Haario et al. 2001)
+    and scales it to reach a target acceptance rate (Andrieu & Thoms 2008).
+    The proposal is only adapted during burn-in, afterwards it is fixed.
+    """
+
+    # Number of updates before the covariance of the history replaces the initial one
+    START = 100
+
+    # Number of updates between two factorizations of the covariance
+    INTERVAL = 50
+
+    # Relative regularization, keeps the covariance positive definite
+    EPSILON = 1e-6
+
+    def __init__(self, initialCovariance, target):
+        """
+        :param initialCovariance: the covariance used until START updates are made
+        :param target: the target acceptance rate
+        """
+
+        self.target = target
+        self._initial = np.atleast_2d(initialCovariance)
+        self._dim = len(self._initial)
+        self._regularization = AdaptiveProposal.EPSILON * np.diag(np.diag(self._initial))
+
+        # Running mean and sum of squared deviations of the history
+        self._n = 0
+        self._mean = np.zeros(self._dim)
+        self._deviations = np.zeros((self._dim, self._dim))
+
+        # Global scale (log) and Cholesky factor of the covariance
+        self._logScale = 0.0
+        self._factor = np.linalg.cholesky(self._initial + self._regularization)
+
+    def noise(self, standardNormal):
+        """
+        Transform standard normal noise into proposal noise.
+        :param standardNormal: the standard normal noise, shape (#parameters,)
+        :return: the proposal noise, shape (#parameters,)
+        """
+
+        return np.exp(self._logScale) * self._factor.dot(standardNormal)
+
+    def update(self, current, accepted):
+        """
+        Add the current values to the history and adapt the scale towards the target rate.
+        :param current: the current values of the chain
+        :param accepted: 1 if the last proposal was accepted, 0 otherwise
+        :return: None
+        """
+
+        # Welford update of the mean and deviations
+        self._n += 1
+        delta = current - self._mean
+        self._mean += delta / self._n
+        self._deviations += np.outer(delta, current - self._mean)
+
+        # Robbins-Monro step with decreasing gain
+        self._logScale += (accepted - self.target) / self._n ** 0.6
+
+        if self._n >= AdaptiveProposal.START and self._n % AdaptiveProposal.INTERVAL == 0:
+            self._factorize()
+
+    def covariance(self):
+        """Returns the current covariance of the proposal."""
+
+        return np.exp(2 * self._logScale) * self._factor.dot(self._factor.T)
+
+    def _factorize(self):
+        """Factorize the covariance of the history, scaled by 2.38^2 / d."""
+
+        covariance = self._deviations / (self._n - 1) * 2.38**2 / self._dim
+        try:
+            self._factor = np.linalg.cholesky(covariance + self._regularization)
+        except np.linalg.LinAlgError:
+            # Keep the previous factor, e.g., while the chain has not moved yet
+            pass
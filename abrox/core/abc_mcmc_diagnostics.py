@@ -0,0 +1,53 @@
+import numpy as np
+
+
+def rhat(chains):
+    """
+    Compute the potential scale reduction factor (Gelman-Rubin R-hat)
+    of each parameter. Values close to 1 indicate that the chains have
+    converged to the same distribution.
+    :param chains: the samples of all chains, shape (#chains, #samples, #parameters)
+    :return: the R-hat of each parameter (NaN for a single chain)
+    """
+    m, n, _ = chains.shape
+    if m < 2 or n < 2:
+        return np.full(chains.shape[2], np.nan)
+
+    # Between- and within-chain variances
+    between = n * np.var(np.mean(chains, axis=1), axis=0, ddof=1)
+    within = np.mean(np.var(chains, axis=1, ddof=1), axis=0)
+    pooled = (n - 1) / n * within + between / n
+    return np.sqrt(pooled / within)
+
+
+def effectiveSampleSize(chain):
+    """
+    Compute the effective sample size of each parameter of a single chain,
+    truncating the sum of autocorrelations at the first negative pair
+    (Geyer's initial positive sequence).
+    :param chain: the samples of one chain, shape (#samples, #parameters)
+    :return: the effective sample size of each parameter
+    """
+    n = len(chain)
+    if n < 2:
+        return np.full(chain.shape[1], np.nan)
+
+    centered = chain - np.mean(chain, axis=0)
+    variance = np.sum(centered**2, axis=0)
+
+    # Autocorrelations of all lags at once via the FFT
+    size = 2 ** int(np.ceil(np.log2(2 * n)))
+    spectrum = np.fft.rfft(centered, size, axis=0)
+    autocov = np.fft.irfft(spectrum * np.conj(spectrum), size, axis=0)[:n]
+
+    ess = np.empty(chain.shape[1])
+    for j in range(chain.shape[1]):
+        if variance[j] == 0:
+            ess[j] = np.nan
+            continue
+        rho = autocov[:, j] / variance[j]
+        pairs = rho[:n - n % 2].reshape(-1, 2).sum(axis=1)
+        negative = np.flatnonzero(pairs < 0)
+        pairs = pairs[:negative[0]] if len(negative) else pairs
+        ess[j] = n / max(2 * np.sum(pairs) - 1, 1 / n)
+    return ess
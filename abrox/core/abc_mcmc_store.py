@@ -0,0 +1,110 @@
+import json
+import os
+import pickle
+import shutil
+import numpy as np
+
+
+class ABCChainStore:
+    """
+    Stores the kept samples of ABC-MCMC chains in a directory while they run.
+    The samples of each chain are written to a memory-mapped .npy file,
+    which is flushed together with the state of the chain (current values,
+    counters and generator states) after every block of steps, so that an
+    interrupted run keeps its progress and can be resumed.
+    """
+
+    META = 'chains.json'
+    TARGET = 'target.npz'
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def prepare(self, seed, chainLength, thin, burn, nChains, resume, target):
+        """
+        Start a new store or validate an existing one for resuming.
+        :param seed: the base seed of the chain seeds (None if not specified)
+        :param chainLength: the number of steps per chain
+        :param thin: the thinning interval
+        :param burn: the number of burn-in steps
+        :param nChains: the number of chains
+        :param resume: if True, keep the chains of a compatible previous run
+        :param target: a dictionary of arrays defining the target of the chains
+        (threshold, MAD and scaled observed summary statistics)
+        :return: the base seed and the target to use (those of the previous
+        run when resuming, so that the chains continue with the same target)
+        """
+
+        metaFile = os.path.join(self.directory, ABCChainStore.META)
+        targetFile = os.path.join(self.directory, ABCChainStore.TARGET)
+
+        if resume and os.path.isfile(metaFile):
+            with open(metaFile) as infile:
+                meta = json.load(infile)
+            if meta['chl'] != chainLength or meta['thin'] != thin or meta['burn'] != burn or \
+                    meta['chains'] != nChains or (seed is not None and meta['seed'] != seed):
+                raise ValueError('The chains in {} belong to a different run and '
+                                 'cannot be resumed.'.format(self.directory))
+            with np.load(targetFile) as saved:
+                return meta['seed'], {name: saved[name] for name in saved.files}
+
+        # Start from scratch
+        self.clear()
+        os.makedirs(self.directory)
+        if seed is None:
+            seed = int(np.random.randint(2**31))
+        meta = {'seed': seed, 'chl': chainLength, 'thin': thin,
+                'burn': burn, 'chains': nChains}
+        with open(metaFile, 'w') as outfile:
+            json.dump(meta, outfile)
+        np.savez(targetFile, **target)
+        return seed, target
+
+    def openSamples(self, chain, count, nParams):
+        """
+        Returns the memory-mapped samples of a chain, those of a previous
+        run if there are any, otherwise a new file of count rows.
+        """
+
+        path = self._file(chain, 'npy')
+        if os.path.isfile(path):
+            return np.load(path, mmap_mode='r+')
+        return np.lib.format.open_memmap(path, mode='w+', dtype=np.float64, shape=(count, nParams))
+
+    def loadSamples(self, chain):
+        """Returns the samples of a chain."""
+
+        return np.load(self._file(chain, 'npy'))
+
+    def save(self, chain, samples, state):
+        """
+        Flush the samples of a chain and save its state. The state is written
+        under a temporary name first, so that a killed run never leaves a
+        truncated state, and only after the samples it refers to are on disk.
+        """
+
+        samples.flush()
+        path = self._file(chain, 'pkl')
+        with open(path + '.tmp', 'wb') as outfile:
+            pickle.dump(state, outfile, pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+    def load(self, chain):
+        """Returns the saved state of a chain, or None."""
+
+        path = self._file(chain, 'pkl')
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as infile:
+            return pickle.load(infile)
+
+    def clear(self):
+        """Remove the store directory."""
+
+        if os.path.isdir(self.directory):
+            shutil.rmtree(self.directory)
+
+    def _file(self, chain, extension):
+        """Returns the path of a file of a chain."""
+
+        return os.path.join(self.directory, 'chain_{}.{}'.format(chain, extension))
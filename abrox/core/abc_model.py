@@ -1,33 +1,69 @@
 from collections import OrderedDict
-import sys
+import numpy as np
+
+from abrox.core.abc_utils import funcSource
+
 
 class ABCModel:
     """Defines a model in a format suitable for ABC."""
 
-    def __init__(self, name, priors, simulate):
+    def __init__(self, name, priors, simulate, simulate_batch=None):
         """
         Constructor requires following information:
         :param name: string - the internal name of the model
         :param prior: list - a list of dicts containing {priorName: stats.[dist]}
         :param simulate: function - the simulate function defined by the user
+        :param simulate_batch: function - optional vectorized simulate function, which
+        accepts a parameter matrix of shape (n, #parameters) and returns n stacked datasets
         """
         self.name = name
         self.currentParam = OrderedDict()
         self._priors = priors
         self._simulateFunc = simulate
+        self._simulateBatchFunc = simulate_batch
+
+        # Flatten the list of prior dicts once, so that drawing
+        # parameters does not need to walk the dicts every time
+        self._paramNames = [name for prior in priors for name in prior.keys()]
+        self._dists = [dist for prior in priors for dist in prior.values()]
 
     def drawParameter(self):
         """Draw a value from each prior distribution"""
-        for priorDict in self._priors:
-            for name, dist in priorDict.items():
-                self.currentParam[name] = dist.rvs()
+        for name, dist in zip(self._paramNames, self._dists):
+            self.currentParam[name] = dist.rvs()
         return self.currentParam
 
+    def drawParameters(self, n, randomState=None):
+        """
+        Draw n values from each prior distribution with a single call per prior.
+        :param n: the number of parameter sets to draw
+        :param randomState: optional numpy RandomState, defaults to the global generator
+        :return: a contiguous numpy array of shape (n, #parameters)
+        """
+        params = np.empty(shape=(n, len(self._dists)))
+        for i, dist in enumerate(self._dists):
+            params[:, i] = dist.rvs(size=n, random_state=randomState)
+        return params
+
+    def toParamDict(self, paramRow):
+        """
+        Convert a row of drawn parameters to a dictionary.
+        Necessary since the user simulate function only accepts dict.
+        :param paramRow: a sequence of parameter values
+        :return: an OrderedDict with parameter-names : parameter-values
+        """
+        return OrderedDict(zip(self._paramNames, paramRow))
+
     def getPriors(self):
         """Returns the list with model priors."""
 
         return self._priors
 
+    def getParamNames(self):
+        """Returns the flat list of parameter names."""
+
+        return self._paramNames
+
     def simulate(self, param):
         """
         Simulate data from user-defined simulate function.
@@ -36,8 +72,31 @@ class ABCModel:
         """
         return self._simulateFunc(param)
 
+    def hasBatchSimulate(self):
+        """Returns True if the user has provided a vectorized simulate function."""
+
+        return self._simulateBatchFunc is not None
+
+    def simulateBatch(self, params):
+        """
+        Simulate a whole batch of datasets from the user-defined batch simulate function.
+        :param params: a numpy array of shape (n, #parameters), columns ordered as the priors
+        :return: the output of the batch simulate function, stacked along the first axis
+        """
+        return self._simulateBatchFunc(params)
+
+    def spec(self):
+        """
+        Returns a description of everything determining the simulations
+        of the model (priors and simulate functions), e.g. for caching.
+        """
+
+        priors = [(name, dist.dist.name, dist.args, sorted(dist.kwds.items()))
+                  for name, dist in zip(self._paramNames, self._dists)]
+        return (self.name, priors, funcSource(self._simulateFunc),
+                funcSource(self._simulateBatchFunc))
+
     def __repr__(self):
         """Provides a nice representation of the user defined model."""
 
-        return 'Model:(name={}, params={})'.format(
-            self.name, [list(prior.keys())[0] for prior in self._priors])
+        return 'Model:(name={}, params={})'.format(self.name, self._paramNames)
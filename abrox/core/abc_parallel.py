@@ -0,0 +1,62 @@
+import itertools
+import os
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+
+
+# Supported parallel backends for generating the reference table
+BACKENDS = ('serial', 'threads', 'processes')
+
+
+class SerialPool:
+    """
+    Mimics the interface of a multiprocessing pool, but
+    runs all tasks sequentially in the calling process.
+    """
+
+    def __init__(self, initializer=None, initargs=()):
+        if initializer is not None:
+            initializer(*initargs)
+
+    def starmap(self, func, iterable, chunksize=None):
+        """Apply func to each argument tuple in iterable."""
+        return list(itertools.starmap(func, iterable))
+
+    def imap_unordered(self, func, iterable, chunksize=1):
+        """Lazily apply func to each argument in iterable."""
+        return map(func, iterable)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+def resolveJobs(jobs):
+    """
+    Translate the user-specified number of jobs into a worker count.
+    :param jobs: a positive integer, or None/-1 for all cores
+    :return: the number of workers
+    """
+    if jobs is None or jobs == -1:
+        return os.cpu_count() or 1
+    return int(jobs)
+
+
+def createPool(backend, jobs, initializer=None, initargs=()):
+    """
+    Create a pool of workers according to the backend.
+    :param backend: one of 'serial', 'threads' or 'processes'
+    :param jobs: the number of workers (ignored for 'serial')
+    :param initializer: optional function each worker calls once on startup
+    :param initargs: the arguments of the initializer
+    :return: a pool supporting starmap and the context manager protocol
+    """
+    if backend == 'serial':
+        return SerialPool(initializer, initargs)
+    if backend == 'threads':
+        return ThreadPool(jobs, initializer, initargs)
+    if backend == 'processes':
+        return Pool(jobs, initializer, initargs)
+    raise ValueError('Unknown parallel backend: {}. Use one of {}.'.format(backend, ', '.join(BACKENDS)))
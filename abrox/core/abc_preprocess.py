@@ -1,15 +1,99 @@
-from multiprocessing import Pool
-import numpy as np
 import itertools
+import os
+import numpy as np
 
-
-from abrox.core.abc_utils import euclideanDistance
+from abrox.core.abc_utils import euclideanDistance, euclideanDistanceMatrix
+from abrox.core.abc_checkpoint import ABCCheckpoint
+from abrox.core.abc_parallel import createPool, resolveJobs
 from abrox.core.abc_reference_table import RefTable
 from abrox.core.abc_scale import ABCScaler
 
 
+# Per-worker state, filled once by _initWorker when the pool starts,
+# so that models and summarizer are not shipped with every task
+_workerState = {}
+
+
+def _initWorker(models, summarizer, width, selection=None):
+    """
+    Store models, summarizer and the parameter width in the worker. For
+    streaming rejection, selection is a tuple of (MAD, scaled observed
+    summary statistics, number of rows to keep).
+    """
+
+    _workerState['models'] = models
+    _workerState['summarizer'] = summarizer
+    _workerState['width'] = width
+    _workerState['selection'] = selection
+
+
+def _simulateChunk(chunk):
+    """
+    Run a chunk of simulations of one model inside a worker.
+    1. Draw all parameters of the chunk from the priors
+    2. Simulate data (vectorized, if the model provides simulate_batch)
+    3. Compute summary statistics
+    :param chunk: a tuple of (row offset in the table, model index,
+    number of simulations, seed of the random number generator)
+    :return: the row offset, the model index, the parameters padded with NaN
+    to the common width (count, width) and the summary statistics (count, s)
+    """
+    offset, modelindex, count, seed = chunk
+    model = _workerState['models'][modelindex]
+    summarizer = _workerState['summarizer']
+
+    # Priors and simulator get independent streams derived from the chunk seed.
+    # Threads share the global generator, so the parameters are drawn from
+    # a generator of their own to stay reproducible with every backend
+    paramSeed, simulationSeed = [child.generate_state(1)[0] for child in np.random.SeedSequence(seed).spawn(2)]
+    np.random.seed(simulationSeed)
+    params = model.drawParameters(count, np.random.RandomState(paramSeed))
+    if model.hasBatchSimulate():
+        sumstats = summarizer.summarizeBatch(model.simulateBatch(params))
+    else:
+        sumstats = np.array([np.ravel(summarizer.summary(model.simulate(model.toParamDict(param))))
+                             for param in params])
+
+    padded = np.full((count, _workerState['width']), np.nan)
+    padded[:, :params.shape[1]] = params
+    return offset, modelindex, padded, sumstats.reshape(count, -1)
+
+
+def _selectFromChunk(chunk):
+    """
+    Run a chunk of simulations inside a worker (see _simulateChunk) and
+    return only the rows closest to the observed data, so that a worker
+    never ships more than keep rows back.
+    :param chunk: a tuple of (row offset, model index, count, seed)
+    :return: the best rows as a tuple of (row numbers, model indices,
+    parameters, unscaled summary statistics, distances)
+    """
+    offset, modelindex, params, sumstats = _simulateChunk(chunk)
+    mad, scaledSumStatObsData, keep = _workerState['selection']
+
+    distance = euclideanDistance(sumstats / mad, scaledSumStatObsData)
+    rows = np.arange(offset, offset + len(params))
+    idx = np.full(len(params), modelindex, dtype=np.int64)
+    return _keepClosest((rows, idx, params, sumstats, distance), keep)
+
+
+def _keepClosest(best, keep):
+    """
+    Reduce a tuple of (row numbers, model indices, parameters, summary
+    statistics, distances) to the keep rows with the smallest distance.
+    """
+    distance = best[-1]
+    if len(distance) <= keep:
+        return best
+    selected = np.argpartition(distance, keep - 1)[:keep]
+    return tuple(column[selected] for column in best)
+
+
 class ABCPreProcessor:
 
+    # Number of rows scaled at once in the second, chunked pass
+    BLOCKSIZE = 100000
+
     def __init__(self, model, summarizer, sumStatObsData):
 
         # Private attributes
@@ -22,29 +106,24 @@ class ABCPreProcessor:
         self.sumStatObsData = sumStatObsData
         self.scaledSumStatObsData = None
 
-    def _generateSample(self, _, modelindex):
+    def _generateChunks(self, simulations, chunksize, seed):
         """
-        Run one simulation.
-        1. Draw parameter from model
-        2. Simulate data
-        3. Compute summary statistics
-        4. Add row to reference Table
+        Split the simulations of each model into work units. The seed of
+        each chunk is derived from the base seed and the row offset of the
+        chunk, so a given chunk always yields the same simulations.
+        :param simulations: number of simulations per model
+        :param chunksize: number of simulations per work unit
+        :param seed: the base seed
+        :return: a list of (row offset, model index, count, seed) tuples
         """
-        param = self._models[modelindex].drawParameter()
-        simdata = self._models[modelindex].simulate(param)
-        sumstat = self.summarizer.summary(simdata)
-        return modelindex, list(param.values()), sumstat, -1
-
-    def _generateArgs(self, simulations, nModels):
-        """
-        Generate argument list.
-        :param simulations:
-        :param nModels:
-        :return:
-        """
-        iterations = np.tile(np.arange(simulations), nModels)
-        modelindices = np.repeat(np.arange(nModels), simulations)
-        return list(zip(iterations, modelindices))
+        chunks = []
+        for modelindex in range(len(self._models)):
+            for start in range(0, simulations, chunksize):
+                count = min(chunksize, simulations - start)
+                offset = modelindex * simulations + start
+                chunkSeed = np.random.SeedSequence([seed, offset]).generate_state(1)[0]
+                chunks.append((offset, modelindex, count, chunkSeed))
+        return chunks
 
     def getFirstModel(self):
         """
@@ -54,54 +133,304 @@ class ABCPreProcessor:
 
         return self._models[0]
 
-    def fillTable(self, simulations, parallel, jobs):
+    def fillTable(self, simulations, backend='processes', jobs=None, chunksize=None, store=None,
+                  seed=None, checkpoint=None, resume=False):
         """
         Run (summarize(simulate()) #simulation
         and store results in ABC table. Return summary statistics
         for scaling as numpy array.
+        :param simulations: number of simulations per model
+        :param backend: one of 'serial', 'threads' or 'processes'
+        :param jobs: number of workers, None or -1 for all cores
+        :param chunksize: number of simulations dispatched to a worker at once
+        :param store: optional directory, chunks are then written to
+        memory-mapped column files as soon as the workers finish them
+        :param seed: optional base seed, makes the table reproducible (with the
+        'threads' backend, simulate functions drawing from the global numpy
+        generator are reproducible only with a single worker)
+        :param checkpoint: optional directory where finished chunks are saved
+        :param resume: if True, only the chunks missing in checkpoint are simulated
         """
 
-        args = self._generateArgs(simulations, len(self._models))
-        with Pool(jobs) as pool:
+        jobs = 1 if backend == 'serial' else resolveJobs(jobs)
+        if not chunksize:
+            chunksize = max(1, -(-simulations // (4 * jobs)))
+
+        # A checkpoint fixes seed and chunk size, so that resumed chunks line up
+        finished = set()
+        if checkpoint is not None:
+            checkpoint = ABCCheckpoint(checkpoint)
+            seed, chunksize = checkpoint.prepare(simulations, len(self._models), seed, chunksize, resume)
+            finished = checkpoint.finishedOffsets()
+        elif seed is None:
+            seed = np.random.randint(2**31)
+
+        chunks = self._generateChunks(simulations, chunksize, seed)
+        pending = [chunk for chunk in chunks if chunk[0] not in finished]
+        width = max(len(model.getParamNames()) for model in self._models)
+        rows = simulations * len(self._models)
 
-            Starmap = pool.starmap if parallel else itertools.starmap
-            out = Starmap(self._generateSample, args) if parallel else list(Starmap(self._generateSample, args))
+        with createPool(backend, jobs, _initWorker, (self._models, self.summarizer, width)) as pool:
+            # Chunks restored from the checkpoint come first, then the new ones
+            restored = (checkpoint.load(offset) for offset in sorted(finished))
+            simulated = pool.imap_unordered(_simulateChunk, pending)
+            for i, (offset, modelindex, params, sumstats) in \
+                    enumerate(itertools.chain(restored, simulated)):
+                # Allocate columns as soon as the number of summary statistics is known
+                if i == 0:
+                    self._refTableWrapper.allocate(rows, width, sumstats.shape[1], store)
+                self._refTableWrapper.fillChunk(offset, modelindex, params, sumstats)
+                if checkpoint is not None and offset not in finished:
+                    checkpoint.save(offset, modelindex, params, sumstats)
 
-        self._refTableWrapper.initialize(out)
+        self._refTableWrapper.flush()
 
-        return self._refTableWrapper.getColumn('sumstat')
+        # The table is complete, the checkpoint is not needed anymore
+        if checkpoint is not None:
+            checkpoint.clear()
 
-    def preprocess(self, simulations, parallel=True, jobs=2):
+        return self._refTableWrapper.getColumn('rawsumstat')
+
+    def _growTable(self, simulations, backend, jobs, chunksize, store, seed):
         """
-        Generate the complete ABC reference table.
-        :param sumStatObsData: summary statistics of observed data
-        :param simulations: number of rows in the table
-        :param parallel: boolean flag
-        :param jobs: number of jobs if parallel
-        :return: None
+        Simulate additional rows and append them to the current table.
+        The chunk seeds of the new rows are derived from the base seed
+        and the current table size, so they never repeat earlier chunks.
         """
 
-        # Pre-fill table and return unscaled summary statistics
-        sumStatTable = self.fillTable(simulations, parallel, jobs)
+        table = self._refTableWrapper
+        if seed is not None:
+            seed = np.random.SeedSequence([seed, len(table)]).generate_state(1)[0]
 
-        # Scale summary statistics and store MAD
-        scaledSumStatTable = self.scaler.fit_transform(sumStatTable)
+        self._refTableWrapper = RefTable()
+        self.fillTable(simulations, backend, jobs, chunksize, seed=seed)
+        self._refTableWrapper = table.append(self._refTableWrapper, store)
+
+    def _scaleAndComputeDistance(self, blocksize, store=None):
+        """
+        Fit the MAD on the unscaled summary statistics of the whole table, then
+        scale them and compute the distance to the observed data block by block,
+        so that a memory-mapped table is never loaded into memory as a whole.
+        :param blocksize: the number of rows processed at once
+        :param store: optional directory for the memory-mapped scaled columns
+        :return: None
+        """
 
-        # Override unscaled with scaled summary statistics
-        self._refTableWrapper.fillColumn(scaledSumStatTable, 'sumstat')
+        table = self._refTableWrapper
+        rawSumStatTable = table.getColumn('rawsumstat')
+
+        # Compute and store MAD
+        self.scaler.fit(rawSumStatTable)
 
         # Scale observed summary statistics with MAD calculated above
         self.scaledSumStatObsData = self.scaler.transform(self.sumStatObsData)
 
-        # Compute distance
-        distance = euclideanDistance(scaledSumStatTable, self.scaledSumStatObsData)
+        table.allocateScaled(self.scaler.mad, store)
+        sumStatTable = table.getColumn('sumstat')
+        for start in range(0, len(table), blocksize):
+            block = slice(start, start + blocksize)
+            sumStatTable[block] = self.scaler.transform(rawSumStatTable[block])
+
+        self._computeDistance(blocksize)
+
+    def _computeDistance(self, blocksize):
+        """
+        Compute the distance between the scaled summary statistics of
+        the table and the scaled observed summary statistics block by block.
+        :param blocksize: the number of rows processed at once
+        :return: None
+        """
+
+        table = self._refTableWrapper
+        sumStatTable = table.getColumn('sumstat')
+        distance = table.getColumn('distance')
+        for start in range(0, len(table), blocksize):
+            block = slice(start, start + blocksize)
+            distance[block] = euclideanDistance(sumStatTable[block], self.scaledSumStatObsData)
+
+        table.flush()
+
+    def rescore(self, refTable, sumStatObsData, blocksize=BLOCKSIZE):
+        """
+        Score new observed data against an existing reference table. The table
+        keeps its MAD, so only the observed summary statistics are scaled and
+        the distances recomputed; nothing is simulated or refitted.
+        :param refTable: a reference table with scaled summary statistics and MAD
+        :param sumStatObsData: the summary statistics of the new observed data
+        :param blocksize: the number of rows processed at once
+        :return: the reference table with updated distances
+        """
+
+        if refTable.mad is None or refTable.getColumn('sumstat') is None:
+            raise ValueError('The reference table has no scaled summary statistics and cannot be rescored.')
+
+        self._refTableWrapper = refTable
+        self.scaler.mad = refTable.mad
+        self.sumStatObsData = sumStatObsData
+        self.scaledSumStatObsData = self.scaler.transform(sumStatObsData)
+
+        # Tables loaded without distances (e.g. from the cache) get a fresh column
+        if refTable.getColumn('distance') is None:
+            refTable.fillColumn(np.empty(len(refTable)), 'distance')
+
+        self._computeDistance(blocksize)
+        return refTable
+
+    def distanceMatrix(self, sumStatObsData, blocksize=BLOCKSIZE, directory=None):
+        """
+        Compute the distances between several observed datasets and all rows of
+        the current reference table, one block of rows at a time, so that the
+        summary statistics of the table are read only once for all datasets.
+        :param sumStatObsData: the unscaled observed summary statistics, shape (m, s)
+        :param blocksize: the number of rows processed at once
+        :param directory: if given, the matrix is a memory-mapped .npy file in this directory
+        :return: the distance matrix, shape (m, #rows)
+        """
+
+        table = self._refTableWrapper
+        if table.mad is None:
+            raise ValueError('The reference table has no MAD to scale the observed data with.')
+
+        scaledSumStatObsData = np.asarray(sumStatObsData) / table.mad
+        shape = (len(scaledSumStatObsData), len(table))
+        if directory is None:
+            distances = np.empty(shape)
+        else:
+            os.makedirs(directory, exist_ok=True)
+            distances = np.lib.format.open_memmap(os.path.join(directory, 'distances.npy'),
+                                                  mode='w+', dtype=np.float64, shape=shape)
+
+        sumStatTable = table.getColumn('sumstat')
+        for start in range(0, len(table), blocksize):
+            block = slice(start, start + blocksize)
+            distances[:, block] = euclideanDistanceMatrix(scaledSumStatObsData, sumStatTable[block])
+
+        return distances
+
+    def preprocessStreaming(self, simulations, keep, pilot, backend='processes', jobs=None,
+                            chunksize=None, seed=None):
+        """
+        Generate only the keep rows of the reference table closest to the observed
+        data, without ever holding the full table. The MAD is estimated from a
+        pilot run first, then each worker returns the best keep rows of its chunk
+        and these are merged into a buffer bounded by keep rows plus one chunk.
+        :param simulations: number of simulations per model
+        :param keep: the number of rows to retain
+        :param pilot: number of pilot simulations per model for estimating the MAD
+        :param backend: one of 'serial', 'threads' or 'processes'
+        :param jobs: number of workers, None or -1 for all cores
+        :param chunksize: number of simulations dispatched to a worker at once
+        :param seed: optional base seed, makes the table reproducible
+        :return: the reference table of the keep closest rows
+        """
+
+        jobs = 1 if backend == 'serial' else resolveJobs(jobs)
+        if not chunksize:
+            chunksize = max(1, -(-simulations // (4 * jobs)))
+        if seed is None:
+            seed = np.random.randint(2**31)
+
+        # Estimate the MAD from a pilot table with seeds apart from the main run
+        self._refTableWrapper = RefTable()
+        pilotSeed = np.random.SeedSequence([seed, simulations * len(self._models)]).generate_state(1)[0]
+        self.scaler.fit(self.fillTable(pilot, backend, jobs, chunksize, seed=pilotSeed))
+        self.scaledSumStatObsData = self.scaler.transform(self.sumStatObsData)
+
+        # Merge the best rows of each chunk as soon as a worker finishes it
+        width = max(len(model.getParamNames()) for model in self._models)
+        selection = (self.scaler.mad, self.scaledSumStatObsData, keep)
+        best = None
+        with createPool(backend, jobs, _initWorker, (self._models, self.summarizer, width, selection)) as pool:
+            for result in pool.imap_unordered(_selectFromChunk, self._generateChunks(simulations, chunksize, seed)):
+                if best is None:
+                    best = result
+                else:
+                    best = _keepClosest(tuple(np.concatenate(pair) for pair in zip(best, result)), keep)
 
-        # Store distance in table
-        self._refTableWrapper.fillColumn(distance, 'distance')
+        # Restore the table order, independent of the order the chunks finished in
+        order = np.argsort(best[0])
+        rows, idx, params, sumstats, distance = (column[order] for column in best)
 
-        return self._refTableWrapper.getRefTable()
+        table = RefTable()
+        table.initialize(idx, params, sumstats)
+        table.allocateScaled(self.scaler.mad)
+        table.fillColumn(self.scaler.transform(sumstats), 'sumstat')
+        table.fillColumn(distance, 'distance')
+        self._refTableWrapper = table
+        return table
 
+    def grow(self, refTable, simulations, backend='processes', jobs=None, chunksize=None,
+             store=None, seed=None):
+        """
+        Append simulations to an existing reference table without recomputing its
+        rows. The MAD and all distances are re-derived from the unscaled summary
+        statistics, so doubling a table only costs the new simulations.
+        :param refTable: the existing reference table (requires unscaled summaries)
+        :param simulations: number of additional simulations per model
+        :param backend: one of 'serial', 'threads' or 'processes'
+        :param jobs: number of workers, None or -1 for all cores
+        :param chunksize: number of simulations dispatched to a worker at once
+        :param store: optional directory for an on-disk (memory-mapped) table
+        :param seed: optional base seed, makes the new rows reproducible
+        :return: the grown reference table
+        """
+
+        if refTable.getColumn('rawsumstat') is None:
+            raise ValueError('The reference table has no unscaled summary statistics and cannot grow.')
+
+        self._refTableWrapper = refTable
+        self._growTable(simulations, backend, jobs, chunksize, store, seed)
+        self._scaleAndComputeDistance(chunksize or ABCPreProcessor.BLOCKSIZE, store)
+        return self._refTableWrapper
+
+    def preprocess(self, simulations, backend='processes', jobs=None, chunksize=None, store=None,
+                   seed=None, checkpoint=None, resume=False, cache=None, grow=0):
+        """
+        Generate the complete ABC reference table.
+        :param simulations: number of rows in the table
+        :param backend: one of 'serial', 'threads' or 'processes'
+        :param jobs: number of workers, None or -1 for all cores
+        :param chunksize: number of simulations dispatched to a worker at once
+        :param store: optional directory for an on-disk (memory-mapped) table
+        :param seed: optional base seed, makes the table reproducible
+        :param checkpoint: optional directory where finished chunks are saved
+        :param resume: if True, only the chunks missing in checkpoint are simulated
+        :param cache: optional ABCRefTableCache to reuse an identical unscaled table
+        :param grow: number of simulations per model appended to the (cached) table
+        :return: the reference table
+        """
 
+        # Look up an identical table simulated by an earlier run,
+        # preferring one that has already been grown
+        cached = None
+        if cache is not None:
+            key = cache.key(self._models, self.summarizer, simulations, seed)
+            if grow:
+                growKey = cache.growKey(key, grow)
+                cached = cache.lookup(growKey)
+            if cached is not None:
+                grow = 0
+            else:
+                cached = cache.lookup(key)
 
+        if cached is not None:
+            # The cached table stays in the cache, the store gets its own raw columns
+            if store is not None:
+                cached.save(store, RefTable.RAW)
+                cached = RefTable.load(store)
+            self._refTableWrapper = cached
+        else:
+            # Pre-fill table with unscaled summary statistics
+            self.fillTable(simulations, backend, jobs, chunksize, store,
+                           seed, checkpoint, resume)
+            if cache is not None:
+                cache.store(key, self._refTableWrapper)
 
+        # Append new simulations to the existing rows
+        if grow:
+            self._growTable(grow, backend, jobs, chunksize, store, seed)
+            if cache is not None:
+                cache.store(growKey, self._refTableWrapper)
 
+        self._scaleAndComputeDistance(chunksize or ABCPreProcessor.BLOCKSIZE, store)
+        return self._refTableWrapper
@@ -1,38 +1,188 @@
+import os
+import pickle
 import numpy as np
-from sklearn.ensemble import RandomForestClassifier
-from abrox.core.abc_utils import toArray
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
+
+from abrox.core.abc_parallel import createPool, resolveJobs
+from abrox.core.abc_reference_table import RefTable
+from abrox.core.abc_utils import fingerprint
 
 
 class ABCRandomForest:
-    """Implements a random forest for ABC model selection."""
+    """
+    Implements a random forest for ABC model selection. If a directory is
+    given, the fitted forest is saved there together with the MAD of the
+    reference table and reused as long as table and specs are the same.
+    """
+
+    FILE = 'rf_model.pkl'
 
-    def __init__(self, refTable, preprocessor, settings, modelNames):
+    def __init__(self, refTable, preprocessor, settings, modelNames, directory=None):
 
         self._refTable = refTable
         self._pp = preprocessor
         self._settings = settings
         self._modelNames = modelNames
+        self._directory = directory
+
+        # Public attributes, the estimated prior error rate and confusion matrix
+        self.errorRate = None
+        self.confusionMatrix = None
+
+    def _forestSpecs(self):
+        """
+        Returns the keyword arguments of the forest. The trees are fitted by
+        as many workers as the reference table, if not specified otherwise.
+        """
+
+        specs = {key: value for key, value in self._settings['specs'].items() if key != 'error'}
+        if 'n_jobs' not in specs:
+            specs['n_jobs'] = 1 if self._settings['backend'] == 'serial' else resolveJobs(self._settings['jobs'])
+        if 'random_state' not in specs and self._settings['seed'] is not None:
+            specs['random_state'] = self._settings['seed']
+        return specs
+
+    def _runSpecs(self):
+        """
+        Returns the forest specs and how the error rate is estimated: either from
+        the out-of-bag predictions of the final forest (default) or by a 5-fold
+        cross-validation.
+        """
+
+        error = self._settings['specs'].get('error', 'oob')
+        specs = self._forestSpecs()
+        if error == 'oob':
+            specs['oob_score'] = True
+        return specs, error
 
     def run(self):
         """Runs according to settings (these must be specified by user.)"""
 
-        rf = RandomForestClassifier(**self._settings['specs'])
+        specs, error = self._runSpecs()
+
+        # Reuse a forest fitted on the same table with the same specs
+        key = fingerprint(self._refTable.digest(), fingerprint(sorted(specs.items()), error))
+        rf = self._load(key)
+        if rf is None:
+            rf = self._fit(RandomForestClassifier(**specs), error)
+            self._save(key, rf)
+
+        # Predict probabilities of models on summary obs
+        sumStatTest = np.array(self._pp.scaledSumStatObsData).reshape(1, -1)
+        pred = rf.predict_proba(sumStatTest)
+
+        if self.errorRate is not None:
+            print("Prior error rate ({}): {:.3f}".format(error, self.errorRate))
+
+        return {mod : np.round(pred[0,i],3) for i, mod in enumerate(self._modelNames)}
+
+    def _fit(self, rf, error):
+        """Fit the forest and estimate its error rate."""
 
         # Extract sum stats and model indices from ref table
-        indices = toArray(self._refTable, 'idx').flatten()
-        sumStat = toArray(self._refTable, 'sumstat')
+        indices = self._refTable.getColumn('idx')
+        sumStat = self._refTable.getColumn('sumstat')
 
         # Do a 5-fold cross-validation
-        accuracies = self._cross_val(sumStat, indices, rf, 5)
+        if error == 'cv':
+            accuracies = self._cross_val(sumStat, indices, rf, 5)
+            self.errorRate = 1 - np.mean(accuracies)
 
         # Fit on summary statistics (the more the better)
         rf.fit(sumStat, indices)
 
-        # Predict probabilities of models on summary obs
-        sumStatTest = np.array(self._pp.scaledSumStatObsData).reshape(1, -1)
-        pred = rf.predict_proba(sumStatTest)
+        if error == 'oob':
+            self._outOfBagError(rf, indices)
+        return rf
 
-        return {mod : np.round(pred[0,i],3) for i, mod in enumerate(self._modelNames)}
+    def _save(self, key, rf):
+        """Save the fitted forest with everything needed to predict new data."""
+
+        if self._directory is None:
+            return
+
+        saved = {'key': key, 'forest': rf, 'mad': self._refTable.mad,
+                 'modelNames': self._modelNames, 'errorRate': self.errorRate,
+                 'confusionMatrix': self.confusionMatrix}
+        os.makedirs(self._directory, exist_ok=True)
+        with open(os.path.join(self._directory, ABCRandomForest.FILE), 'wb') as outfile:
+            pickle.dump(saved, outfile, pickle.HIGHEST_PROTOCOL)
+
+    def _load(self, key):
+        """Returns the saved forest, or None if there is none for key."""
+
+        if self._directory is None:
+            return None
+
+        saved = ABCRandomForest._loadSaved(self._directory)
+        if saved is None or saved['key'] != key:
+            return None
+
+        self.errorRate = saved['errorRate']
+        self.confusionMatrix = saved['confusionMatrix']
+        return saved['forest']
+
+    @staticmethod
+    def _loadSaved(directory):
+        """Returns the dictionary saved in directory, or None."""
+
+        path = os.path.join(directory, ABCRandomForest.FILE)
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as infile:
+            return pickle.load(infile)
+
+    def hasSaved(self):
+        """
+        Check, without loading the table into memory, if a forest with the same
+        specs was saved for the very table stored in the directory. The digest
+        of the table only reads sample rows of the memory-mapped columns.
+        """
+
+        saved = ABCRandomForest._loadSaved(self._directory) if self._directory is not None else None
+        if saved is None:
+            return False
+
+        specs, error = self._runSpecs()
+        digest = RefTable.load(self._directory, mmap='r').digest()
+        return saved['key'] == fingerprint(digest, fingerprint(sorted(specs.items()), error))
+
+    @staticmethod
+    def predictSaved(directory, sumStatObsData):
+        """
+        Predict model probabilities for new observed data with a forest saved by an
+        earlier run, without touching the reference table.
+        :param directory: the directory the forest was saved in (the store of the table)
+        :param sumStatObsData: the unscaled summary statistics of one dataset (s,)
+        or several datasets (m, s)
+        :return: a dictionary of model probabilities, or a DataFrame
+        with one row per dataset if several datasets are given
+        """
+
+        saved = ABCRandomForest._loadSaved(directory)
+        if saved is None:
+            raise ValueError('There is no random forest saved in {}.'.format(directory))
+
+        sumStatObsData = np.asarray(sumStatObsData)
+        pred = saved['forest'].predict_proba(np.atleast_2d(sumStatObsData) / saved['mad'])
+        if sumStatObsData.ndim == 1:
+            return {mod: np.round(pred[0, i], 3) for i, mod in enumerate(saved['modelNames'])}
+        return pd.DataFrame(pred, columns=saved['modelNames'])
+
+    def _outOfBagError(self, rf, indices):
+        """
+        Compute the prior error rate and the confusion matrix from the out-of-bag
+        predictions of a fitted forest, i.e., each row is predicted only by the
+        trees which have not seen it. Saves the confusion matrix as csv.
+        """
+
+        self.errorRate = 1 - rf.oob_score_
+
+        predicted = rf.classes_[np.argmax(rf.oob_decision_function_, axis=1)]
+        self.confusionMatrix = pd.crosstab(pd.Series(indices, name="Actual"),
+                                           pd.Series(predicted, name="Predicted"))
+        self.confusionMatrix.to_csv(self._settings['outputdir'] + '/rf_oob_confusion.csv')
 
     def _cross_val(self, X, y, classifier, nfolds=10):
         """
@@ -52,20 +202,19 @@ class ABCRandomForest:
         np.random.shuffle(data)
 
         # Split data into (almost) equal folds (returns a list of arrays)
-        # and we cast the list into a numpy array in order to do list indexing
-        data = np.array(np.array_split(data, nfolds))
+        folds = np.array_split(data, nfolds)
 
         # Do the k-fold cross-validation
         accs = []
         for k in range(nfolds):
             # Get current test set
-            X_k_test = data[k][:, :-1]
-            y_k_test = data[k][:, -1]
+            X_k_test = folds[k][:, :-1]
+            y_k_test = folds[k][:, -1].astype(y.dtype)
 
-            # Get remaining indices and current training set
-            remaining_idx = [i for i, v in enumerate(data) if i != k]
-            X_k_train = np.vstack(data[remaining_idx])[:, :-1]
-            y_k_train = np.vstack(data[remaining_idx])[:, -1]
+            # Get current training set from the remaining folds
+            training = np.vstack([fold for i, fold in enumerate(folds) if i != k])
+            X_k_train = training[:, :-1]
+            y_k_train = training[:, -1].astype(y.dtype)
 
             # Fit and predict with classifier
             classifier.fit(X_k_train, y_k_train)
@@ -80,3 +229,102 @@ class ABCRandomForest:
         """A utility function to compute the accuracy of the classifier"""
 
         return np.sum(y == yhat) / len(y)
+
+
+class ABCRandomForestRegressor:
+    """
+    Implements ABC random forest regression for parameter inference. A regression
+    forest is fitted per parameter on the scaled summary statistics of the reference
+    table and the posterior is approximated by weighting the rows of the table
+    by how often they share a leaf with the observed data (quantile regression forest).
+    """
+
+    # Criteria of the classifier, which are not available for regression
+    CLASSIFICATION_CRITERIA = ('gini', 'entropy', 'log_loss')
+
+    def __init__(self, refTable, preprocessor, settings, quantiles=(0.025, 0.25, 0.5, 0.75, 0.975)):
+
+        self._refTable = refTable
+        self._pp = preprocessor
+        self._settings = settings
+        self._quantiles = quantiles
+        self._specs = None
+
+    def _forestSpecs(self, nParams):
+        """
+        Returns the keyword arguments of the forests. The available workers are
+        shared by the forests, which are fitted at the same time (one per parameter).
+        """
+
+        specs = {key: value for key, value in self._settings['specs'].items()
+                 if key not in ('error', 'quantiles')}
+        if specs.get('criterion') in ABCRandomForestRegressor.CLASSIFICATION_CRITERIA:
+            del specs['criterion']
+        if 'n_jobs' not in specs:
+            jobs = 1 if self._settings['backend'] == 'serial' else resolveJobs(self._settings['jobs'])
+            specs['n_jobs'] = max(1, jobs // nParams)
+        if 'random_state' not in specs and self._settings['seed'] is not None:
+            specs['random_state'] = self._settings['seed']
+        return specs
+
+    def _posterior(self, rf, sumStat, param, sumStatObs):
+        """
+        Compute the posterior summaries of one parameter from a fitted forest.
+        :param rf: the fitted regression forest
+        :param sumStat: the summary statistics the forest was fitted on
+        :param param: the parameter values the forest was fitted on
+        :param sumStatObs: the scaled observed summary statistics, shape (1, s)
+        :return: a list of mean, variance and the quantiles
+        """
+
+        # Weight each row by the share of the leaf it has in common with the
+        # observed data, one tree at a time to keep the memory bounded
+        weights = np.zeros(len(param))
+        for tree in rf.estimators_:
+            leaves = tree.apply(sumStat)
+            sameLeaf = leaves == tree.apply(sumStatObs)[0]
+            weights[sameLeaf] += 1 / np.sum(sameLeaf)
+        weights /= len(rf.estimators_)
+
+        mean = rf.predict(sumStatObs)[0]
+        variance = np.sum(weights * (param - np.sum(weights * param))**2)
+
+        # Weighted quantiles from the cumulative weights of the sorted values
+        order = np.argsort(param)
+        sortedParam = param[order]
+        cumulative = np.cumsum(weights[order])
+        quantiles = [sortedParam[min(np.searchsorted(cumulative, q), len(param) - 1)]
+                     for q in self._quantiles]
+        return [mean, variance] + quantiles
+
+    def _fitAndSummarize(self, column):
+        """Fit the forest of one parameter and return its posterior summaries."""
+
+        param = self._refTable.getColumn('param')[:, column]
+        valid = ~np.isnan(param)
+        sumStat = np.asarray(self._refTable.getColumn('sumstat'))[valid]
+        param = param[valid]
+
+        rf = RandomForestRegressor(**self._specs)
+        rf.fit(sumStat, param)
+        sumStatObs = np.array(self._pp.scaledSumStatObsData).reshape(1, -1)
+        return self._posterior(rf, sumStat, param, sumStatObs)
+
+    def run(self):
+        """
+        Fit the forests of all parameters in parallel.
+        :return: a DataFrame with posterior mean, variance and quantiles per parameter
+        """
+
+        paramNames = self._settings['pnames']
+        self._quantiles = self._settings['specs'].get('quantiles', self._quantiles)
+        self._specs = self._forestSpecs(len(paramNames))
+
+        # Threads suffice, since the forests release the GIL while fitting
+        with createPool('threads', len(paramNames)) as pool:
+            rows = pool.starmap(self._fitAndSummarize, [(i,) for i in range(len(paramNames))])
+
+        posterior = pd.DataFrame(rows, index=paramNames,
+                                 columns=['mean', 'variance'] + ['{:g}%'.format(q * 100) for q in self._quantiles])
+        posterior.to_csv(self._settings['outputdir'] + '/rf_posterior.csv')
+        return posterior
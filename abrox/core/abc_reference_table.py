@@ -1,32 +1,181 @@
-import pandas as pd
+import hashlib
+import os
 import numpy as np
 
-from abrox.core.abc_utils import toArray
-
 
 class RefTable:
-    """ 
+    """
     Holds the final ABC Table where each row corresponds to one simulation.
-    Contains information about:
-     - model index
-     - summary statistics
-     - drawn parameters
-     - distance to observed data
+    The table is stored column-wise as contiguous numpy arrays:
+     - idx: model index, shape (n,)
+     - param: drawn parameters, shape (n, #parameters), padded with
+       NaN for models with less parameters than others
+     - rawsumstat: unscaled summary statistics, shape (n, #summary statistics)
+     - sumstat: scaled summary statistics, shape (n, #summary statistics)
+     - distance: distance to observed data, shape (n,)
+    Alongside the columns, the table keeps the MAD used to scale the summary
+    statistics (mad, shape (#summary statistics,)), so that a new observed
+    dataset can be scored without simulating or refitting anything.
+    The columns can either live in memory or in memory-mapped
+    .npy files of an on-disk store (one file per column).
     """
 
-    def __init__(self):
-        self._table = None
+    COLUMNS = ('idx', 'param', 'rawsumstat', 'sumstat', 'distance')
+    DTYPES = {'idx': np.int64, 'param': np.float64, 'rawsumstat': np.float64,
+              'sumstat': np.float64, 'distance': np.float64}
+
+    # The columns determined by the simulations alone, independent of the observed data
+    RAW = ('idx', 'param', 'rawsumstat')
+
+    def __init__(self, idx=None, param=None, sumstat=None, distance=None, rawsumstat=None, mad=None):
+        self.idx = idx
+        self.param = param
+        self.rawsumstat = rawsumstat
+        self.sumstat = sumstat
+        self.distance = distance
+        self.mad = mad
+
+    def initialize(self, idx, param, sumstat):
+        """ Initialize Reference Table from unscaled summary statistics."""
+
+        self.idx = np.ascontiguousarray(idx, dtype=np.int64)
+        self.param = np.ascontiguousarray(param, dtype=np.float64)
+        self.rawsumstat = np.ascontiguousarray(sumstat, dtype=np.float64).reshape(len(self.idx), -1)
+        self.sumstat = None
+        self.distance = None
+        self.mad = None
+
+    def allocate(self, rows, paramWidth, sumstatWidth, directory=None):
+        """
+        Allocate empty raw columns to be filled chunk by chunk.
+        :param rows: the number of rows of the table
+        :param paramWidth: the number of parameter columns
+        :param sumstatWidth: the number of summary statistics
+        :param directory: if given, the columns are memory-mapped .npy files
+        in this directory, so that the table does not need to fit in memory
+        :return: None
+        """
+
+        shapes = {'idx': (rows,), 'param': (rows, paramWidth), 'rawsumstat': (rows, sumstatWidth)}
+        for name in RefTable.RAW:
+            setattr(self, name, RefTable._emptyColumn(name, shapes[name], directory))
+        self.sumstat = None
+        self.distance = None
+        self.mad = None
+
+    def allocateScaled(self, mad, directory=None):
+        """
+        Allocate the scaled summary statistics and the distance column,
+        matching the shape of the raw summary statistics.
+        :param mad: the MAD the summary statistics are scaled with
+        :param directory: if given, the columns are memory-mapped .npy files
+        and the MAD is saved next to them
+        :return: None
+        """
+
+        self.mad = np.asarray(mad, dtype=np.float64)
+        if directory is not None:
+            np.save(RefTable._columnFile(directory, 'mad'), self.mad)
+        self.sumstat = RefTable._emptyColumn('sumstat', self.rawsumstat.shape, directory)
+        self.distance = RefTable._emptyColumn('distance', (len(self),), directory)
+        self.distance[:] = -1.0
+
+    def fillChunk(self, offset, idx, param, sumstat):
+        """Store a chunk of simulations (unscaled summaries) starting at row offset."""
+
+        rows = slice(offset, offset + len(param))
+        self.idx[rows] = idx
+        self.param[rows] = param
+        self.rawsumstat[rows] = sumstat
+
+    def append(self, other, directory=None):
+        """
+        Returns a new table with the raw columns of other appended to the
+        raw columns of this table. Scaled columns have to be recomputed.
+        :param other: the reference table to append
+        :param directory: if given, the new table is written to memory-mapped
+        .npy files in this directory (which may hold this very table)
+        :return: the concatenated reference table
+        """
+
+        table = RefTable()
+        tmpDirectory = directory + '.tmp' if directory is not None else None
+        for name in RefTable.RAW:
+            first, second = getattr(self, name), getattr(other, name)
+            column = RefTable._emptyColumn(name, (len(first) + len(second),) + first.shape[1:],
+                                           tmpDirectory)
+            column[:len(first)] = first
+            column[len(first):] = second
+            setattr(table, name, column)
+
+        if directory is not None:
+            # Swap in the new files only after all columns have been copied
+            table.flush()
+            os.makedirs(directory, exist_ok=True)
+            for name in RefTable.RAW:
+                os.replace(RefTable._columnFile(tmpDirectory, name), RefTable._columnFile(directory, name))
+                setattr(table, name, np.load(RefTable._columnFile(directory, name), mmap_mode='r+'))
+            os.rmdir(tmpDirectory)
 
-    def initialize(self, content):
-        """ Initialize Reference Table."""
+        return table
 
-        cols = ['idx', 'param', 'sumstat', 'distance']
-        self._table = pd.DataFrame(content, columns=cols)
+    def flush(self):
+        """Write pending changes of memory-mapped columns to disk."""
 
-    def getRefTable(self):
-        """ Returns the actual pandas DataFrame."""
+        for name in RefTable.COLUMNS:
+            column = getattr(self, name)
+            if isinstance(column, np.memmap):
+                column.flush()
+
+    def save(self, directory, columns=COLUMNS):
+        """
+        Save the given (existing) columns as .npy files into directory.
+        The MAD is saved along with the scaled summary statistics.
+        """
 
-        return self._table
+        os.makedirs(directory, exist_ok=True)
+        for name in columns:
+            if getattr(self, name) is not None:
+                np.save(RefTable._columnFile(directory, name), getattr(self, name))
+        if 'sumstat' in columns and self.mad is not None:
+            np.save(RefTable._columnFile(directory, 'mad'), self.mad)
+
+    @classmethod
+    def load(cls, directory, mmap='r+'):
+        """
+        Load a reference table saved with save or generated on disk.
+        Columns without a file in directory are None.
+        :param directory: the directory containing the column files
+        :param mmap: the numpy memory-map mode of the columns ('r+', 'r', 'c'),
+        or None to read the columns into memory
+        :return: the reference table
+        """
+
+        table = cls()
+        for name in RefTable.COLUMNS:
+            path = RefTable._columnFile(directory, name)
+            if os.path.isfile(path):
+                setattr(table, name, np.load(path, mmap_mode=mmap or None))
+        if os.path.isfile(RefTable._columnFile(directory, 'mad')):
+            table.mad = np.load(RefTable._columnFile(directory, 'mad'))
+        return table
+
+    @staticmethod
+    def _emptyColumn(name, shape, directory=None):
+        """Returns an empty column, memory-mapped if a directory is given."""
+
+        if directory is None:
+            return np.empty(shape, dtype=RefTable.DTYPES[name])
+
+        os.makedirs(directory, exist_ok=True)
+        return np.lib.format.open_memmap(RefTable._columnFile(directory, name), mode='w+',
+                                         dtype=RefTable.DTYPES[name], shape=shape)
+
+    @staticmethod
+    def _columnFile(directory, name):
+        """Returns the path of the .npy file of a column."""
+
+        return os.path.join(directory, name + '.npy')
 
     def fillColumn(self, data, columnName):
         """
@@ -35,18 +184,74 @@ class RefTable:
         after scaling.
         """
 
-        if columnName == 'sumstat':
-            data = [np.array(row) for row in data]
-        self._table[columnName] = data
+        if columnName not in RefTable.COLUMNS:
+            raise KeyError('Unknown reference table column: {}'.format(columnName))
+        setattr(self, columnName, data)
 
     def getColumn(self, columnName):
-        """Returns given column as numpy array."""
+        """Returns given column as numpy array (no copy is made)."""
+
+        if columnName not in RefTable.COLUMNS:
+            raise KeyError('Unknown reference table column: {}'.format(columnName))
+        return getattr(self, columnName)
+
+    def subset(self, rows):
+        """
+        Returns a new reference table containing only the given rows.
+        :param rows: integer indices or a boolean mask
+        :return: the subset reference table
+        """
+
+        table = RefTable()
+        for name in RefTable.COLUMNS:
+            column = getattr(self, name)
+            setattr(table, name, column[rows] if column is not None else None)
+        table.mad = self.mad
+        return table
+
+    def toDataFrame(self, paramNames=None):
+        """
+        Returns a flat pandas DataFrame with one column per parameter
+        and (scaled) summary statistic (e.g., for exporting to csv).
+        :param paramNames: optional names of the parameter columns
+        :return: the DataFrame
+        """
+
+        import pandas as pd
+
+        if paramNames is None:
+            paramNames = ['p{}'.format(i) for i in range(self.param.shape[1])]
+        sumstat = self.sumstat if self.sumstat is not None else self.rawsumstat
+        sumstatNames = ['s{}'.format(i) for i in range(sumstat.shape[1])]
+
+        df = pd.DataFrame(self.param, columns=paramNames)
+        df = pd.concat([df, pd.DataFrame(sumstat, columns=sumstatNames)], axis=1)
+        df.insert(0, 'idx', self.idx)
+        df['distance'] = self.distance
+        return df
+
+    def digest(self, samples=1000):
+        """
+        Returns a hex digest identifying the content of the table. Instead of
+        hashing every row, the shapes, the MAD and evenly spaced sample rows are
+        hashed, which is enough to tell tables of different runs apart.
+        :param samples: the number of sample rows
+        :return: the SHA-256 hex digest
+        """
 
-        return toArray(self._table, columnName)
+        sha = hashlib.sha256()
+        rows = np.unique(np.linspace(0, len(self) - 1, samples).astype(np.int64))
+        for name in RefTable.COLUMNS:
+            column = getattr(self, name)
+            if column is not None and name != 'distance':
+                sha.update(name.encode('utf-8'))
+                sha.update(repr(column.shape).encode('utf-8'))
+                sha.update(np.ascontiguousarray(column[rows]).tobytes())
+        if self.mad is not None:
+            sha.update(np.ascontiguousarray(self.mad).tobytes())
+        return sha.hexdigest()
 
-    def fillRow(self, row, idx, param, sumstat):
-        """Fill a row of the table. Distance is calculated later."""
+    def __len__(self):
+        """Returns the number of rows."""
 
-        self._table.loc[row, 'idx'] = idx
-        self._table.set_value(row, 'param', param)
-        self._table.set_value(row, 'sumstat', sumstat)
+        return len(self.idx)
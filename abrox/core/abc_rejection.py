@@ -3,17 +3,71 @@ import numpy as np
 
 class ABCRejection:
 
-    def __init__(self, refTable, keep):
+    # Number of distances partitioned at once, so that a memory-mapped
+    # distance column is never loaded into memory as a whole
+    BLOCKSIZE = 10000000
+
+    def __init__(self, refTable, keep, threshold=None):
         self.refTable = refTable
         self.keep = keep
+        self.threshold = threshold
+
+    def _closestRows(self, distance):
+        """
+        Select the indices of the keep rows with the smallest distance.
+        Each block is partitioned separately and only its keep best
+        candidates are retained, then the candidates are partitioned once more.
+        :param distance: the distance column (array or memory-mapped)
+        :return: the row indices (unordered)
+        """
+        keep = min(self.keep, len(distance))
+        candidates = []
+        for start in range(0, len(distance), ABCRejection.BLOCKSIZE):
+            block = np.asarray(distance[start:start + ABCRejection.BLOCKSIZE])
+            if len(block) > keep:
+                rows = np.argpartition(block, keep - 1)[:keep]
+            else:
+                rows = np.arange(len(block))
+            candidates.append(rows + start)
+
+        candidates = np.concatenate(candidates)
+        if len(candidates) > keep:
+            candidates = candidates[np.argpartition(distance[candidates], keep - 1)[:keep]]
+        return candidates
+
+    def _rowsWithinThreshold(self, distance):
+        """
+        Select the indices of all rows with a distance <= threshold.
+        :param distance: the distance column (array or memory-mapped)
+        :return: the row indices
+        """
+        rows = []
+        for start in range(0, len(distance), ABCRejection.BLOCKSIZE):
+            block = distance[start:start + ABCRejection.BLOCKSIZE]
+            rows.append(np.flatnonzero(block <= self.threshold) + start)
+        return np.concatenate(rows)
+
+    def selectRows(self):
+        """
+        Return the indices of the accepted rows in table order and the threshold.
+        Without a fixed threshold, exactly keep rows are accepted and the
+        threshold is the largest accepted distance, otherwise all rows with
+        distance <= threshold are accepted.
+        :return: the tuple
+        """
+        distance = self.refTable.getColumn('distance')
+        if self.threshold is not None:
+            return self._rowsWithinThreshold(distance), self.threshold
+
+        rows = np.sort(self._closestRows(distance))
+        threshold = distance[rows].max() if len(rows) else np.nan
+        return rows, threshold
 
     def reject(self):
         """
         Return tuple with filtered Reference Table only containing
-        rows for which the distance is < threshold and threshold itself.
+        the accepted rows (see selectRows) and threshold itself.
         :return: the tuple
         """
-        q = self.keep / len(self.refTable.index) * 100
-        threshold = np.percentile(self.refTable['distance'],q=q)
-        subset = self.refTable[self.refTable['distance'] < threshold]
-        return subset, threshold
+        rows, threshold = self.selectRows()
+        return self.refTable.subset(rows), threshold
@@ -3,8 +3,6 @@ from itertools import combinations
 import pandas as pd
 import numpy as np
 
-from abrox.core.abc_utils import toArray
-
 
 class ABCReporter:
 
@@ -17,7 +15,7 @@ class ABCReporter:
 
     def initParamTable(self):
         """ Initialise the parameter table."""
-        paramArray = toArray(self.table, 'param')
+        paramArray = self.table.getColumn('param')
         return pd.DataFrame(paramArray, columns=self.paramNames)
 
     def bayesFactor(self):
@@ -31,7 +29,7 @@ class ABCReporter:
 
         counter = Counter(counterDict)
 
-        counter.update(self.table['idx'])
+        counter.update(self.table.getColumn('idx'))
 
         orderedCounter = OrderedDict(sorted(counter.items()))
 
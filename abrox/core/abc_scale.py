@@ -15,6 +15,14 @@ class ABCScaler:
         """Compute MAD for each column."""
         self.mad = np.apply_along_axis(self._mad, 0, summaryStats)
 
+    def fit(self, summaryStats):
+        """
+        Compute and store the MAD column by column, so that only a single
+        column is loaded at once if summaryStats is memory-mapped.
+        """
+        self.mad = np.array([self._mad(np.asarray(summaryStats[:, j]))
+                             for j in range(summaryStats.shape[1])])
+
     def fit_transform(self, summaryStats):
         """ Store MAD and return scaled summary statistics."""
 
@@ -24,6 +32,5 @@ class ABCScaler:
     def transform(self, data):
         """Scale data using MAD computed from fit_transform."""
 
-        data /= self.mad
-        return data
+        return np.asarray(data) / self.mad
 
@@ -1,11 +1,36 @@
+import numpy as np
+
+from abrox.core.abc_utils import funcSource
+
 
 class ABCSummary:
     """A wrapper class over the user-defined summary func."""
 
-    def __init__(self, summary):
+    def __init__(self, summary, summaryBatch=None):
         self.summary = summary
+        self._summaryBatch = summaryBatch
 
     def summarize(self, data):
         """Compute and return summary statistics from data."""
 
         return self.summary(data).flatten()
+
+    def spec(self):
+        """Returns the source of the summary functions, e.g. for caching."""
+
+        return funcSource(self.summary), funcSource(self._summaryBatch)
+
+    def summarizeBatch(self, data):
+        """
+        Compute summary statistics for datasets stacked along the first axis.
+        Uses the user-defined batch summary if provided, otherwise falls
+        back to calling the summary function on each dataset.
+        :param data: the stacked datasets
+        :return: a numpy array of shape (n, #summary statistics)
+        """
+
+        if self._summaryBatch is not None:
+            sumStats = np.asarray(self._summaryBatch(data))
+        else:
+            sumStats = np.array([np.ravel(self.summary(dataset)) for dataset in data])
+        return sumStats.reshape(len(data), -1)
@@ -1,7 +1,10 @@
+import hashlib
+import inspect
 import numpy as np
-import pandas as pd
 import pickle
 
+from abrox.core.abc_reference_table import RefTable
+
 # ABC utility functions
 
 
@@ -18,19 +21,50 @@ def euclideanDistance(a, b, axis=1):
     return np.linalg.norm(a-b, axis=axis)
 
 
-# convert pandas object column to np.array
-def toArray(df, name):
+def euclideanDistanceMatrix(a, b):
+    """
+    Compute the euclidean distance between every row of a and every row of b
+    at once, using ||a||^2 + ||b||^2 - 2ab' instead of broadcasting a-b.
+    :param a: observed summary statistics, shape (m, s)
+    :param b: simulated summary statistics, shape (n, s)
+    :return: the distance matrix, shape (m, n)
+    """
+    a = np.asarray(a)
+    b = np.asarray(b)
+    squared = np.sum(a**2, axis=1)[:, np.newaxis] + np.sum(b**2, axis=1) - 2 * a.dot(b.T)
+
+    # Rounding can produce tiny negative values for identical rows
+    return np.sqrt(np.maximum(squared, 0.0))
+
+
+def funcSource(func):
+    """
+    Returns the source code of a user-defined function, used to detect
+    whether the function has changed between runs. Falls back to the
+    byte code if the source is not available.
+    :param func: the function (or None)
+    :return: a string representation of the function
+    """
+    if func is None:
+        return 'None'
+    try:
+        return inspect.getsource(func)
+    except (OSError, TypeError):
+        code = func.__code__
+        return repr((code.co_code, code.co_consts, code.co_names))
+
+
+def fingerprint(*parts):
     """
-    Convert pandas column to numpy array.
-    :param df: the pandas DataFrame
-    :param name: the column name
-    :return: a multidimensional numpy array
+    Returns a hex digest uniquely identifying the given parts.
+    :param parts: objects with a deterministic string representation
+    :return: the SHA-256 hex digest
     """
-    alist = list(df[name].values)
-    if isinstance(alist[0], (list, np.ndarray)):
-        return np.array(alist)
-    else:
-        return np.array(alist).reshape(-1, 1)
+    sha = hashlib.sha256()
+    for part in parts:
+        sha.update(repr(part).encode('utf-8'))
+        sha.update(b'\0')
+    return sha.hexdigest()
 
 
 def cross_val(X, y, classifier, nfolds=5):
@@ -86,24 +120,19 @@ def read_external(path):
     """
     Read external reference table as csv and convert to ABrox ref table.
     :param path: path to file
-    :return: reference table as pandas dataframe.
+    :return: reference table as columnar RefTable.
     """
+    import pandas as pd
+
     dfRaw = pd.read_csv(path,sep=",")
 
     paramCols = [col for col in dfRaw if col.startswith('p')]
     sumstatCols = [col for col in dfRaw if col.startswith('s')]
 
-    refTable = pd.DataFrame(index=dfRaw.index,columns=['idx','param','sumstat'])
-    refTable['idx'] = dfRaw['idx']
-    refTable['param'] = dfRaw[paramCols].as_matrix().tolist()
-
-    sumstatArray = dfRaw[sumstatCols].as_matrix().tolist()
-    sumstats = [np.array(sumstatList) for sumstatList in sumstatArray]
-    refTable['sumstat'] = sumstats
-
-    refTable['distance'] = dfRaw['distance']
-
-    return refTable
+    return RefTable(np.ascontiguousarray(dfRaw['idx'].values, dtype=np.int64),
+                    np.ascontiguousarray(dfRaw[paramCols].values, dtype=np.float64),
+                    np.ascontiguousarray(dfRaw[sumstatCols].values, dtype=np.float64),
+                    np.ascontiguousarray(dfRaw['distance'].values, dtype=np.float64))
 
 
 def pickle_results(output, outputdir):
@@ -2,13 +2,11 @@ import numpy as np
 from collections import OrderedDict
 from scipy import stats
 
-from abrox.core.abc_utils import toArray
-
 
 class Wegmann:
 
     def __init__(self, subset, paramNames):
-        self.paramArray = toArray(subset,'param')
+        self.paramArray = subset.getColumn('param')
         self.paramNames = paramNames
 
     def getProposal(self):
@@ -33,6 +31,18 @@ class Wegmann:
         """
         return self.paramArray[self._pickRandomRowIndex()]
 
+    def getStartingValuesOfChains(self, n, randomState=None):
+        """
+        Pick n distinct random rows from the subset as starting values of n chains
+        (rows are only repeated if the subset has fewer than n rows).
+        :param n: the number of chains
+        :param randomState: optional numpy RandomState, defaults to the global generator
+        :return: an array of shape (n, #parameter)
+        """
+        generator = randomState if randomState is not None else np.random
+        rows = generator.choice(self.paramArray.shape[0], n, replace=n > self.paramArray.shape[0])
+        return self.paramArray[rows]
+
     def _pickRandomRowIndex(self):
         """
         Pick a random row index from the subset reference table.
@@ -234,6 +234,20 @@ class ASettingsDialog(QDialog):
             QLabel('Number of simulations:'),
             ASettingEntry(self._internalModel, 'simulations', True)
         ]
+        self._parallelEntries = {
+            'backend': (QLabel('Parallel Backend:'), AComboBox(['serial', 'threads', 'processes'])),
+            'jobs': (QLabel('Workers:'), ASettingEntry(self._internalModel, 'jobs', True)),
+            'chunksize': (QLabel('Chunk Size:'), ASettingEntry(self._internalModel, 'chunksize', True))
+        }
+        self._growEntry = [
+            QLabel('Append simulations:'),
+            ASettingEntry(self._internalModel, 'grow', True)
+        ]
+        self._checkpointChecks = {
+            'checkpoint': QCheckBox('Checkpoint finished chunks'),
+            'resume': QCheckBox('Resume from checkpoint'),
+            'cache': QCheckBox('Reuse cached table')
+        }
 
     def _createReferenceTableSettingsBox(self):
         """Creates a reference table."""
@@ -263,6 +277,35 @@ class ASettingsDialog(QDialog):
 
         # Add file selector entry to layout
         refGroupBoxLayout.addWidget(self._refTableWidget, 2, 0, 1, 2)
+
+        # Add parallel settings, None means all cores or automatic chunks
+        self._parallelEntries['backend'][1].setValue(self._internalModel.refTableSetting('backend', 'processes'))
+        autoChecks = {'jobs': 'All cores', 'chunksize': 'Automatic'}
+        for row, key in enumerate(['backend', 'jobs', 'chunksize'], 3):
+            refGroupBoxLayout.addWidget(self._parallelEntries[key][0], row, 0, 1, 1)
+            refGroupBoxLayout.addWidget(self._parallelEntries[key][1], row, 1, 1, 1)
+
+            if key in autoChecks:
+                value = self._internalModel.refTableSetting(key)
+                autoCheck = QCheckBox(autoChecks[key])
+                if value is None:
+                    autoCheck.setChecked(True)
+                    self._toggleParallelSetting(True, key)
+                else:
+                    self._parallelEntries[key][1].setValue(value)
+                autoCheck.toggled.connect(lambda checked, key=key: self._toggleParallelSetting(checked, key))
+                refGroupBoxLayout.addWidget(autoCheck, row, 2)
+
+        # Add checkpoint and resume checkbuttons
+        for col, key in enumerate(['checkpoint', 'resume', 'cache']):
+            self._checkpointChecks[key].setChecked(self._internalModel.refTableSetting(key, False))
+            refGroupBoxLayout.addWidget(self._checkpointChecks[key], 6, col, 1, 1)
+
+        # Add number of simulations appended to a cached table
+        self._growEntry[1].setValue(self._internalModel.refTableSetting('grow', 0))
+        refGroupBoxLayout.addWidget(self._growEntry[0], 7, 0, 1, 1)
+        refGroupBoxLayout.addWidget(self._growEntry[1], 7, 1, 1, 1)
+
         refGroupBox.setLayout(refGroupBoxLayout)
         return refGroupBox
 
@@ -320,6 +363,12 @@ class ASettingsDialog(QDialog):
         self._settingsEntries[key][0].setEnabled(not enabled)
         self._settingsEntries[key][1].setEnabled(not enabled)
 
+    def _toggleParallelSetting(self, enabled, key):
+        """A helper to toggle parallel settings on/off."""
+
+        self._parallelEntries[key][0].setEnabled(not enabled)
+        self._parallelEntries[key][1].setEnabled(not enabled)
+
     def _onExt(self, checked):
         """Activated when user decides to add external reference."""
 
@@ -340,8 +389,18 @@ class ASettingsDialog(QDialog):
 
         refTableSpecs = {
             'simulations': int(self._simEntry[1].val()),
-            'extref': self._refTableWidget.val()
+            'extref': self._refTableWidget.val(),
+            'backend': self._parallelEntries['backend'][1].val(),
+            'seed': self._internalModel.refTableSetting('seed'),
+            'checkpoint': self._checkpointChecks['checkpoint'].isChecked(),
+            'resume': self._checkpointChecks['resume'].isChecked(),
+            'cache': self._checkpointChecks['cache'].isChecked(),
+            'grow': int(self._growEntry[1].val())
         }
+        for key in ['jobs', 'chunksize']:
+            # A deselected entry means all cores or automatic chunks
+            entry = self._parallelEntries[key][1]
+            refTableSpecs[key] = entry.val() if entry.isEnabled() else None
         method = {
             'algorithm': self._algorithm(),
             'specs': methodSpecs
@@ -363,7 +422,8 @@ class ARejectionSettingsDialog(ASettingsDialog):
         self._settingsEntries = {
             'keep': (QLabel('Keep:'), ASettingEntry(self._internalModel, 'keep', True)),
             'threshold': (QLabel('Threshold:'), ASettingEntry(self._internalModel, 'threshold')),
-            'cv': (QLabel('Cross Validation Samples:'), ASettingEntry(self._internalModel, 'cv', True))
+            'cv': (QLabel('Cross Validation Samples:'), ASettingEntry(self._internalModel, 'cv', True)),
+            'pilot': (QLabel('Pilot Simulations:'), ASettingEntry(self._internalModel, 'pilot', True))
         }
         self._initDialog(QVBoxLayout())
 
@@ -374,7 +434,7 @@ class ARejectionSettingsDialog(ASettingsDialog):
         rejectionBoxLayout = QGridLayout()
 
         # Use list in order to show in order
-        keys = ['keep', 'threshold', 'cv']
+        keys = ['keep', 'threshold', 'cv', 'pilot']
 
         if self._internalModel.algorithm() == "rejection":
             # Show settings already selected
@@ -389,7 +449,7 @@ class ARejectionSettingsDialog(ASettingsDialog):
             rejectionBoxLayout.addWidget(self._settingsEntries[key][1], idx, 1, 1, 1)
 
             # Set settings value according to model
-            if specs[key] is not None:
+            if specs.get(key) is not None:
                 self._settingsEntries[key][1].setValue(specs[key])
 
         # Add automatic threshold checkbutton
@@ -402,6 +462,16 @@ class ARejectionSettingsDialog(ASettingsDialog):
         autoCheck.toggled.connect(self._onAuto)
         rejectionBoxLayout.addWidget(autoCheck, keys.index('threshold'), 2)
 
+        # Add streaming checkbutton, a pilot run enables streaming rejection
+        streamCheck = QCheckBox()
+        streamCheck.setText('No streaming')
+        if specs.get('pilot') is None:
+            streamCheck.setChecked(True)
+            self._toggleSetting(True, 'pilot')
+
+        streamCheck.toggled.connect(self._onStream)
+        rejectionBoxLayout.addWidget(streamCheck, keys.index('pilot'), 2)
+
         # Add cross validation checkbutton
         cvCheck = QCheckBox()
         cvCheck.setText('No CV')
@@ -428,6 +498,11 @@ class ARejectionSettingsDialog(ASettingsDialog):
 
         self._toggleSetting(checked, 'cv')
 
+    def _onStream(self, checked):
+        """Activated when user decides to click the no streaming checkbutton."""
+
+        self._toggleSetting(checked, 'pilot')
+
 
 class AMCMCSettingsDialog(ASettingsDialog):
     """
@@ -446,6 +521,8 @@ class AMCMCSettingsDialog(ASettingsDialog):
             'chl': (QLabel('Chain Length:'), ASettingEntry(self._internalModel, 'chl', True)),
             'burn': (QLabel('Burn-In'), ASettingEntry(self._internalModel, 'burn', True)),
             'thin': (QLabel('Thinning'), ASettingEntry(self._internalModel, 'thin', True)),
+            'n_chains': (QLabel('Number of Chains:'), ASettingEntry(self._internalModel, 'n_chains', True)),
+            'adapt': (QLabel('Target Acceptance Rate:'), ASettingEntry(self._internalModel, 'adapt')),
             'proposal': (QLabel('Proposal Distribution:'), QSpinBox()),
             'start': (QLabel('Optimizer:'), QSpinBox()),
         }
@@ -458,7 +535,7 @@ class AMCMCSettingsDialog(ASettingsDialog):
         mcmcBoxLayout = QGridLayout()
 
         # Use list in order to show in order
-        keys = ['keep', 'threshold', 'chl', 'burn', 'thin', 'proposal', 'start']
+        keys = ['keep', 'threshold', 'chl', 'burn', 'thin', 'n_chains', 'adapt', 'proposal', 'start']
 
         if self._internalModel.algorithm() == "mcmc":
             # Show settings already selected
@@ -473,7 +550,7 @@ class AMCMCSettingsDialog(ASettingsDialog):
             mcmcBoxLayout.addWidget(self._settingsEntries[key][1], idx, 1, 1, 1)
 
             # Set settings value according to model
-            if specs[key] is not None:
+            if specs.get(key) is not None:
                 self._settingsEntries[key][1].setValue(specs[key])
 
         # Add automatic threshold checkbutton
@@ -486,6 +563,16 @@ class AMCMCSettingsDialog(ASettingsDialog):
         autoCheck.toggled.connect(self._onAuto)
         mcmcBoxLayout.addWidget(autoCheck, keys.index('threshold'), 2)
 
+        # Add adaptation checkbutton, a target rate adapts the proposal during burn-in
+        adaptCheck = QCheckBox()
+        adaptCheck.setText('No adaptation')
+        if specs.get('adapt') is None:
+            adaptCheck.setChecked(True)
+            self._toggleSetting(True, 'adapt')
+
+        adaptCheck.toggled.connect(self._onAdapt)
+        mcmcBoxLayout.addWidget(adaptCheck, keys.index('adapt'), 2)
+
         # Add proposal checkbutton
         proposalCheck = QCheckBox()
         proposalCheck.setText('Automatic')
@@ -521,6 +608,11 @@ class AMCMCSettingsDialog(ASettingsDialog):
 
         self._toggleSetting(checked, 'threshold')
 
+    def _onAdapt(self, checked):
+        """Activated when user decides to click the no adaptation checkbutton."""
+
+        self._toggleSetting(checked, 'adapt')
+
     def _onProposal(self, checked):
         """Activated when user toggles the automatic threshold setting"""
 
@@ -630,9 +722,21 @@ class ASettingEntry(QDoubleSpinBox):
         elif self._key == 'simulations':
             self._customize([1, 1e10], 100, 0)
 
+        elif self._key == 'jobs':
+            self._customize([1, 1e4], 1, 0)
+
+        elif self._key == 'chunksize':
+            self._customize([1, 1e10], 100, 0)
+
+        elif self._key == 'grow':
+            self._customize([0, 1e10], 100, 0)
+
         elif self._key == 'cv':
             self._customize([1, 1e10], 10, 0)
 
+        elif self._key == 'pilot':
+            self._customize([1, 1e10], 100, 0)
+
         elif self._key == 'chl':
             self._customize([1, 1e10], 1000, 0)
 
@@ -642,6 +746,13 @@ class ASettingEntry(QDoubleSpinBox):
         elif self._key == 'thin':
             self._customize([0, 1e10], 10, 0)
 
+        elif self._key == 'n_chains':
+            self._customize([1, 1e4], 1, 0)
+
+        elif self._key == 'adapt':
+            self._customize([0.01, 0.99], 0.01, 3)
+            self.setValue(0.234)
+
         elif self._key == 'mdepth':
             self._customize([1, 1e10], 1, 0)
 
@@ -727,4 +838,4 @@ class AComboBox(QComboBox):
         return self.currentText().lower()
 
     def setValue(self, val):
-        self.setCurrentText(val.upper())
\ No newline at end of file
+        self.setCurrentText(val.capitalize())
\ No newline at end of file
@@ -33,7 +33,15 @@ class AInternalModel:
                         'test': {'model': None, 'fixed': OrderedDict()},
                         'reftable': {
                             'simulations': 10000,
-                            'extref': None
+                            'extref': None,
+                            'backend': 'processes',
+                            'jobs': None,
+                            'chunksize': None,
+                            'seed': None,
+                            'checkpoint': False,
+                            'resume': False,
+                            'cache': False,
+                            'grow': 0
                         },
                     })
                     ]
@@ -54,6 +62,10 @@ class AInternalModel:
                          ('chl', 10000),
                          ('burn', 0),
                          ('thin', 1),
+                         ('n_chains', 1),
+                         ('csv', True),
+                         ('adapt', None),
+                         ('resume', False),
                          ('proposal', None),
                          ('start', None)])
                      },
@@ -61,7 +73,8 @@ class AInternalModel:
                        'specs': OrderedDict([
                            ('keep', 100),
                            ('threshold', None),
-                           ('cv', None)])
+                           ('cv', None),
+                           ('pilot', None)])
                        },
             'randomforest': {'algorithm': 'randomforest',
                        'specs': OrderedDict([
@@ -69,7 +82,8 @@ class AInternalModel:
                            ('max_depth', None),
                            ('min_samples_split', 2),
                            ('min_samples_leaf', 1),
-                           ('criterion', 'gini')])
+                           ('criterion', 'gini'),
+                           ('error', 'oob')])
                        }
         }
 
@@ -207,6 +221,11 @@ class AInternalModel:
     def simulations(self):
         return self._project['Analysis']['settings']['reftable']['simulations']
 
+    def refTableSetting(self, key, default=None):
+        """Returns a reference table setting (older projects may lack some keys)."""
+
+        return self._project['Analysis']['settings']['reftable'].get(key, default)
+
     def models(self):
         """Returns the model list."""
 
@@ -0,0 +1,111 @@
+from scipy import stats
+import numpy as np
+
+from abrox.core.abc import Abc
+from abrox.core.abc_model import ABCModel
+from abrox.core.abc_preprocess import ABCPreProcessor
+from abrox.core.abc_summary import ABCSummary
+
+def summary(data):
+    data_mean = np.mean(data, axis=0)
+    diff_mean = data_mean[0] - data_mean[1]
+    mean_std = np.mean(np.std(data, axis=0))
+    return diff_mean / mean_std
+
+def summary_batch(data):
+    data_mean = np.mean(data, axis=1)
+    diff_mean = data_mean[:, 0] - data_mean[:, 1]
+    mean_std = np.mean(np.std(data, axis=1), axis=1)
+    return diff_mean / mean_std
+
+def simulate_Model1(params):
+    n = 1000
+    first_sample = np.random.normal(0, 1, n)
+    sec_sample = np.random.normal(params['d'], 1, n)
+    return np.column_stack((first_sample, sec_sample))
+
+def simulate_batch_Model1(params):
+    n = 1000
+    first_sample = np.random.normal(0, 1, (params.shape[0], n))
+    sec_sample = np.random.normal(params[:, [0]], 1, (params.shape[0], n))
+    return np.stack((first_sample, sec_sample), axis=2)
+
+def simulate_Model2(params):
+    n = 1000
+    first_sample = np.random.normal(0, 1, n)
+    sec_sample = np.random.normal(0, 1, n)
+    return np.column_stack((first_sample, sec_sample))
+
+def simulate_batch_Model2(params):
+    n = 1000
+    return np.random.normal(0, 1, (params.shape[0], n, 2))
+
+
+CONFIG = {
+    "data": {
+        "datafile": None,
+        "delimiter": None
+    },
+    "models": [
+        {
+            "name": "Model1",
+            "priors": [
+                {"d": stats.cauchy(loc=0.0, scale=0.7)},
+        ],
+            "simulate": simulate_Model1,
+            "simulate_batch": simulate_batch_Model1
+        },
+        {
+            "name": "Model2",
+            "priors": [
+            ],
+            "simulate": simulate_Model2,
+            "simulate_batch": simulate_batch_Model2
+        }
+
+    ],
+    "summary": summary,
+    "summary_batch": summary_batch,
+    "distance": None,
+    "settings": {
+        'distance_metric': 'default',
+        'method': {'algorithm': 'rejection',
+                   'specs': {'cv': None, 'keep': 100, 'threshold': None}},
+        'objective': 'comparison',
+        'outputdir': '.',
+        'reftable': {'extref': None, 'simulations': 10000},
+        'test': {'fixed': {'d': 0.5}, 'model': 0}
+    }
+}
+
+
+def test_batch_table_matches_per_row_table():
+    """Batch and per-row simulation yield tables of the same shape and summaries."""
+
+    tables = []
+    for batch in (True, False):
+        models = [ABCModel(model['name'], model['priors'], model['simulate'],
+                           model['simulate_batch'] if batch else None) for model in CONFIG['models']]
+        summarizer = ABCSummary(summary, summary_batch if batch else None)
+        sumStatObsData = summarizer.summarize(simulate_Model1({'d': 0.5}))
+        pp = ABCPreProcessor(models, summarizer, sumStatObsData)
+        tables.append(pp.preprocess(200, 'serial', chunksize=50, seed=1))
+
+    for name in ('idx', 'param', 'rawsumstat', 'sumstat', 'distance'):
+        assert tables[0].getColumn(name).shape == tables[1].getColumn(name).shape
+    assert np.array_equal(tables[0].getColumn('idx'), tables[1].getColumn('idx'))
+
+    # Without a batch function, summarizeBatch falls back to the per-row summary
+    data = np.random.RandomState(0).normal(0, 1, (10, 1000, 2))
+    summarizer = ABCSummary(summary)
+    assert np.array_equal(summarizer.summarizeBatch(data),
+                          np.array([summarizer.summarize(dataset) for dataset in data]))
+    assert np.allclose(ABCSummary(summary, summary_batch).summarizeBatch(data),
+                       summarizer.summarizeBatch(data))
+
+
+if __name__ == "__main__":
+
+    abc = Abc(CONFIG)
+    out = abc.run()
+    print(out)
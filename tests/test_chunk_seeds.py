@@ -0,0 +1,31 @@
+import numpy as np
+from scipy import stats
+
+from abrox.core.abc_model import ABCModel
+from abrox.core.abc_summary import ABCSummary
+from abrox.core import abc_preprocess
+
+
+def simulate(params):
+    return np.random.normal(0, 1, 1)
+
+
+def test_parameters_independent_of_simulations():
+    """Priors and simulator of a chunk must not draw from the same stream."""
+
+    model = ABCModel('Model1', [{'mu': stats.norm(0, 1)}], simulate)
+    summarizer = ABCSummary(lambda data: data[:1])
+    abc_preprocess._initWorker([model], summarizer, 1)
+
+    _, _, params, sumstats = abc_preprocess._simulateChunk((0, 0, 200, 42))
+    assert not np.allclose(params[:, 0], sumstats[:, 0])
+    assert abs(np.corrcoef(params[:, 0], sumstats[:, 0])[0, 1]) < 0.3
+
+    # The chunk is still reproducible from its seed
+    _, _, again, _ = abc_preprocess._simulateChunk((0, 0, 200, 42))
+    assert np.array_equal(params, again)
+
+
+if __name__ == "__main__":
+
+    test_parameters_independent_of_simulations()
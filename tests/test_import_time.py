@@ -0,0 +1,37 @@
+import subprocess
+import sys
+
+# Import time budget in seconds for the entry point and the worker module
+BUDGET = 1.0
+
+# Modules, which must only be imported when an algorithm needs them
+HEAVY = ['pandas', 'scipy', 'sklearn', 'matplotlib', 'keras']
+
+MEASURE = """
+import sys, time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+print(','.join(name for name in {heavy} if name in sys.modules))
+"""
+
+
+def measure(module):
+    """Import module in a fresh interpreter, return seconds and the heavy modules loaded."""
+    out = subprocess.check_output([sys.executable, '-c', MEASURE.format(module=module, heavy=HEAVY)],
+                                  universal_newlines=True).splitlines()
+    return float(out[0]), [name for name in out[1].split(',') if name]
+
+
+def test_import_time():
+    for module in ['abrox.core.abc', 'abrox.core.abc_preprocess']:
+        seconds, loaded = measure(module)
+        assert seconds < BUDGET, '{} took {:.2f}s to import'.format(module, seconds)
+        assert not loaded, '{} imported {}'.format(module, ', '.join(loaded))
+
+
+if __name__ == "__main__":
+
+    for module in ['abrox.core.abc', 'abrox.core.abc_preprocess']:
+        print(module, *measure(module))
+    test_import_time()
@@ -0,0 +1,44 @@
+import tempfile
+import numpy as np
+from scipy import stats
+
+from abrox.core.abc_model import ABCModel
+from abrox.core.abc_preprocess import ABCPreProcessor
+from abrox.core.abc_random_forest import ABCRandomForest
+from abrox.core.abc_summary import ABCSummary
+
+
+def simulate_Model1(params):
+    return np.random.normal(params['mu'], 1, 20)
+
+
+def simulate_Model2(params):
+    return np.random.standard_t(3, 20) + params['mu']
+
+
+def summary(data):
+    return np.array([np.mean(data), np.std(data), np.max(np.abs(data - np.mean(data)))])
+
+
+def test_error_rate_estimates():
+    """The prior error rate can be estimated out-of-bag and by cross validation."""
+
+    models = [ABCModel('Model1', [{'mu': stats.norm(0, 1)}], simulate_Model1),
+              ABCModel('Model2', [{'mu': stats.norm(0, 1)}], simulate_Model2)]
+    summarizer = ABCSummary(summary)
+    pp = ABCPreProcessor(models, summarizer, summarizer.summarize(np.random.RandomState(0).normal(0, 1, 20)))
+    refTable = pp.preprocess(200, 'serial', seed=1)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for error in ['oob', 'cv']:
+            settings = {'specs': {'n_estimators': 20, 'error': error}, 'backend': 'serial',
+                        'jobs': None, 'seed': 1, 'outputdir': directory}
+            rf = ABCRandomForest(refTable, pp, settings, ['Model1', 'Model2'])
+            probabilities = rf.run()
+            assert 0 <= rf.errorRate <= 1
+            assert np.isclose(sum(probabilities.values()), 1)
+
+
+if __name__ == "__main__":
+
+    test_error_rate_estimates()
@@ -0,0 +1,90 @@
+import tempfile
+import numpy as np
+from scipy import stats
+
+from abrox.core.abc_cache import ABCRefTableCache
+from abrox.core.abc_model import ABCModel
+from abrox.core.abc_preprocess import ABCPreProcessor
+from abrox.core.abc_reference_table import RefTable
+from abrox.core.abc_summary import ABCSummary
+
+# Number of simulations, after which the simulator fails (None never)
+_failAfter = [None]
+
+
+def simulate(params):
+    if _failAfter[0] is not None:
+        _failAfter[0] -= 1
+        if _failAfter[0] < 0:
+            raise KeyboardInterrupt
+    return np.random.normal(params['mu'], 1, 20)
+
+
+def summary(data):
+    return np.array([np.mean(data), np.std(data)])
+
+
+def preprocessor():
+    model = ABCModel('Model1', [{'mu': stats.norm(0, 2)}], simulate)
+    summarizer = ABCSummary(summary)
+    return ABCPreProcessor([model], summarizer, summarizer.summarize(np.random.RandomState(0).normal(0.5, 1, 20)))
+
+
+def test_resumed_checkpoint_matches_uninterrupted_run():
+    """A run interrupted after some chunks and resumed yields the same table."""
+
+    with tempfile.TemporaryDirectory() as directory:
+        expected = preprocessor().preprocess(1000, 'serial', chunksize=100, seed=1)
+
+        _failAfter[0] = 450
+        interrupted = False
+        try:
+            preprocessor().preprocess(1000, 'serial', chunksize=100, seed=1, checkpoint=directory)
+        except KeyboardInterrupt:
+            interrupted = True
+        finally:
+            _failAfter[0] = None
+        assert interrupted
+
+        resumed = preprocessor().preprocess(1000, 'serial', chunksize=100, seed=1,
+                                            checkpoint=directory, resume=True)
+        for name in RefTable.COLUMNS:
+            assert np.array_equal(expected.getColumn(name), resumed.getColumn(name))
+
+
+def test_cached_table_into_store():
+    """A table taken from the cache is stored completely when a store is given."""
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ABCRefTableCache(directory + '/cache')
+        expected = preprocessor().preprocess(500, 'serial', seed=2, cache=cache)
+        preprocessor().preprocess(500, 'serial', seed=2, cache=cache, store=directory + '/store')
+
+        stored = RefTable.load(directory + '/store')
+        for name in RefTable.COLUMNS:
+            assert np.array_equal(expected.getColumn(name), stored.getColumn(name))
+        assert np.array_equal(expected.mad, stored.mad)
+
+
+def test_streaming_rejection_keeps_closest_rows():
+    """Streaming rejection keeps the same rows as rejecting from the full table."""
+
+    pp = preprocessor()
+    streamed = pp.preprocessStreaming(2000, 50, 300, 'serial', chunksize=200, seed=3)
+    assert len(streamed) == 50
+
+    # The full table of the same chunks, scaled with the MAD of the pilot run
+    full = preprocessor().preprocess(2000, 'serial', chunksize=200, seed=3)
+    rawSumStat = full.getColumn('rawsumstat')
+    distance = np.linalg.norm(rawSumStat / pp.scaler.mad - pp.scaledSumStatObsData, axis=1)
+    rows = np.sort(np.argsort(distance)[:50])
+
+    assert np.array_equal(full.getColumn('param')[rows], streamed.getColumn('param'))
+    assert np.allclose(distance[rows], streamed.getColumn('distance'))
+
+
+if __name__ == "__main__":
+
+    test_resumed_checkpoint_matches_uninterrupted_run()
+    test_cached_table_into_store()
+    test_streaming_rejection_keeps_closest_rows()